@@ -1,52 +1,688 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session
+from flask import Flask, render_template, request, redirect, url_for, flash, session, abort, jsonify, make_response
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, text, tuple_, update
+from sqlalchemy import inspect as sa_inspect
+from markupsafe import Markup, escape
+from sqlalchemy.orm import joinedload, selectinload
 from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import cached_property, wraps
+from urllib.parse import urlencode
+import base64
+import collections
+import hashlib
+import os
+import pickle
+import queue
+import re
+import sqlite3
+import threading
+import time
+import uuid
+import click
 import markdown
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///blog.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///blog.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# WAL lets readers run alongside the single writer; writers wait up to the busy timeout for the lock
+app.config['SQLITE_WAL'] = os.environ.get('SQLITE_WAL', '1') == '1'
+app.config['SQLITE_BUSY_TIMEOUT_MS'] = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+if ':memory:' not in app.config['SQLALCHEMY_DATABASE_URI']:
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+        'pool_pre_ping': True
+    }
+# Group commit: comments are batched into one transaction every few milliseconds
+app.config['GROUP_COMMIT_MAX_BATCH'] = 200
+app.config['GROUP_COMMIT_MAX_DELAY'] = 0.005
+# 'memory' for an in-process LRU, or 'sqlite:///path' for a cache shared by local worker processes
+app.config['CACHE_BACKEND'] = 'memory'
+app.config['CACHE_TTL'] = 300
+# Stored hashes with other parameters are upgraded on the next successful login
+app.config['PASSWORD_HASH_METHOD'] = 'scrypt:32768:8:1'
+app.config['HASH_WORKERS'] = 4
+app.config['HASH_MAX_PENDING'] = 32
 
 db = SQLAlchemy(app)
 
+def configure_sqlite(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA busy_timeout = {app.config['SQLITE_BUSY_TIMEOUT_MS']}")
+    if app.config['SQLITE_WAL']:
+        cursor.execute("PRAGMA journal_mode = WAL")
+        # Durable at each checkpoint rather than each commit; safe with WAL
+        cursor.execute("PRAGMA synchronous = NORMAL")
+    cursor.close()
+
+with app.app_context():
+    event.listen(db.engine, 'connect', configure_sqlite)
+
+# Write batching
+class GroupCommitWriter:
+    """Collects small writes from many requests and commits them together.
+
+    submit(fn) queues fn(session) and returns a Future with its result. A
+    background thread runs queued writes and commits once per batch of up to
+    max_batch writes or max_delay seconds. If the batch fails it is replayed
+    with a savepoint per write, so only the bad writes fail. Build objects
+    before submitting and keep fn small: the writer thread is the bottleneck,
+    and fn should return plain values because the session is not the caller's.
+    """
+    def __init__(self, max_batch=200, max_delay=0.005):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.queue = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+        
+    def submit(self, fn):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name='group-commit', daemon=True)
+                self.thread.start()
+        future = Future()
+        self.queue.put((fn, future))
+        return future
+    
+    def _run(self):
+        with app.app_context():
+            while True:
+                batch = [self.queue.get()]
+                deadline = time.monotonic() + self.max_delay
+                while len(batch) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(self.queue.get(timeout=remaining))
+                    except queue.Empty:
+                        break
+                self._commit(batch)
+    
+    def _commit(self, batch):
+        try:
+            results = [fn(db.session) for fn, _ in batch]
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            self._commit_isolated(batch)
+            return
+        
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+    
+    def _commit_isolated(self, batch):
+        # Slow path after a failed batch: each write gets its own savepoint
+        # so one bad write does not take the rest of the batch down with it
+        results = []
+        for fn, future in batch:
+            try:
+                with db.session.begin_nested():
+                    results.append((future, fn(db.session), None))
+            except Exception as e:
+                results.append((future, None, e))
+        
+        try:
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            for future, _, _ in results:
+                future.set_exception(e)
+            return
+        
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+comment_writer = GroupCommitWriter(app.config['GROUP_COMMIT_MAX_BATCH'], app.config['GROUP_COMMIT_MAX_DELAY'])
+
+# Password hashing
+class HashPoolFull(Exception):
+    """Raised when too many password hashes are already queued."""
+
+class PasswordHasher:
+    """Runs the deliberately slow password KDFs on a bounded worker pool.
+
+    The pool caps how many KDFs run at once (the calling request thread still
+    waits for its own result); once max_pending hashes are queued, new ones
+    fail fast with HashPoolFull.
+    """
+    def __init__(self, method, workers=4, max_pending=32):
+        self.method = method
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix='password-hash')
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.lock = threading.Lock()
+        self.latencies = collections.deque(maxlen=1000)
+        self.completed = 0
+        self.rejected = 0
+        
+    def _run(self, fn, *args):
+        if not self.slots.acquire(blocking=False):
+            with self.lock:
+                self.rejected += 1
+            raise HashPoolFull()
+        
+        def timed():
+            start = time.perf_counter()
+            try:
+                return fn(*args)
+            finally:
+                with self.lock:
+                    self.latencies.append(time.perf_counter() - start)
+                    self.completed += 1
+                self.slots.release()
+        
+        return self.executor.submit(timed).result()
+    
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+    
+    def verify(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+    
+    @cached_property
+    def method_prefix(self):
+        # Werkzeug expands short methods ('scrypt' -> 'scrypt:32768:8:1'), so
+        # take the prefix from a real hash rather than from the config string
+        return generate_password_hash('', self.method).split('$', 1)[0] + '$'
+    
+    def needs_rehash(self, password_hash):
+        return not password_hash.startswith(self.method_prefix)
+    
+    def metrics(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            completed, rejected = self.completed, self.rejected
+        
+        def percentile(q):
+            return round(latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000, 2) if latencies else None
+        
+        return {
+            'completed': completed,
+            'rejected': rejected,
+            'latency_ms': {'p50': percentile(0.5), 'p95': percentile(0.95), 'max': percentile(1.0)}
+        }
+
+password_hasher = PasswordHasher(app.config['PASSWORD_HASH_METHOD'], app.config['HASH_WORKERS'],
+                                 app.config['HASH_MAX_PENDING'])
+
+# Markdown rendering
+class MarkdownCache:
+    """In-process LRU of rendered HTML keyed by a hash of the Markdown source."""
+    def __init__(self, maxsize=2048):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        
+    def render(self, text):
+        key = hashlib.sha256(text.encode('utf-8')).digest()
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+        
+        html = markdown.markdown(text)
+        with self.lock:
+            self.entries[key] = html
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return html
+
+markdown_cache = MarkdownCache()
+
+def render_markdown(text):
+    return markdown_cache.render(text or '')
+
+def rendered_html(item):
+    """Stored HTML of a post or comment, falling back to the cache for unrendered rows."""
+    return item.content_html if item.content_html is not None else render_markdown(item.content)
+
 # Models
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
-    password_hash = db.Column(db.String(128))
+    password_hash = db.Column(db.String(256))
+    # Denormalized; kept current by new_post, repaired by `flask reconcile-counters`
+    post_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     posts = db.relationship('Post', backref='author', lazy=True)
     
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
         
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return password_hasher.verify(self.password_hash, password)
 
 class Post(db.Model):
+    # Serves the feed's ORDER BY date_posted DESC, id DESC and its keyset seeks
+    __table_args__ = (db.Index('ix_post_date_posted_id', 'date_posted', 'id'),)
+    
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), nullable=False)
     content = db.Column(db.Text, nullable=False)
+    content_html = db.Column(db.Text)
     date_posted = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    # Denormalized; kept current by comment_post, repaired by `flask reconcile-counters`
+    comment_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     comments = db.relationship('Comment', backref='post', lazy=True, cascade="all, delete-orphan")
 
 class Comment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.Text, nullable=False)
+    content_html = db.Column(db.Text)
     date_posted = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), nullable=False, index=True)
     author = db.relationship('User', backref='comments')
 
+# Rendered HTML is refreshed whenever the Markdown source is assigned
+@event.listens_for(Post.content, 'set')
+@event.listens_for(Comment.content, 'set')
+def render_content(target, value, oldvalue, initiator):
+    target.content_html = render_markdown(value)
+
+# Response and fragment caching
+class LRUCacheBackend:
+    """In-process LRU cache with per-entry expiry."""
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or (entry[1] is not None and entry[1] < time.time()):
+                self.entries.pop(key, None)
+                return None
+            self.entries.move_to_end(key)
+            return entry[0]
+    
+    def set(self, key, value, ttl=None):
+        with self.lock:
+            self.entries[key] = (value, time.time() + ttl if ttl else None)
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+    
+
+class SQLiteCacheBackend:
+    """Local stand-in for a shared cache: a SQLite file every worker process opens."""
+    def __init__(self, path, purge_interval=60):
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.lock = threading.Lock()
+        self.purge_interval = purge_interval
+        self.next_purge = 0
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, expires REAL)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)")
+    
+    def _get(self, key):
+        row = self.conn.execute("SELECT value, expires FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return None
+        return pickle.loads(row[0])
+    
+    def get(self, key):
+        with self.lock:
+            return self._get(key)
+    
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?)",
+                              (key, pickle.dumps(value), now + ttl if ttl else None))
+            # Version bumps leave old keys unreachable; drop them once they expire
+            if now >= self.next_purge:
+                self.next_purge = now + self.purge_interval
+                self.conn.execute("DELETE FROM cache WHERE expires < ?", (now,))
+
+def make_cache_backend(url):
+    if url.startswith('sqlite:///'):
+        return SQLiteCacheBackend(url[len('sqlite:///'):])
+    return LRUCacheBackend()
+
+class ResponseCache:
+    """Caches rendered pages and fragments under versioned scopes.
+
+    Keys include the current version of each scope they depend on, so
+    bumping a scope (e.g. 'feed' or 'post:3') makes old entries unreachable
+    without having to find and delete them. Versions are random tokens, not
+    counters: a version evicted from the backend is replaced by a fresh
+    token, so it can never come back to a value old entries were stored under.
+    """
+    def __init__(self, backend, ttl=300):
+        self.backend = backend
+        self.ttl = ttl
+    
+    def version(self, scope):
+        token = self.backend.get('version:' + scope)
+        if token is None:
+            token = self.bump(scope)
+        return token
+    
+    def versions(self, scopes):
+        return ','.join(f"{scope}={self.version(scope)}" for scope in scopes)
+    
+    def bump(self, *scopes):
+        for scope in scopes:
+            token = uuid.uuid4().hex
+            self.backend.set('version:' + scope, token)
+        return token
+    
+    def cached_view(self, scopes):
+        """Cache anonymous GET responses; scopes(**view_args) names what they depend on."""
+        def decorator(view):
+            @wraps(view)
+            def wrapper(**kwargs):
+                # Pages for logged-in users or with pending flash messages are personal
+                if request.method != 'GET' or 'user_id' in session or '_flashes' in session:
+                    return view(**kwargs)
+                
+                # urlencode escapes '&' and '=' inside values, so distinct query strings never collide
+                args = urlencode(sorted(request.args.items(multi=True)))
+                key = f"page:{request.path}?{args}|{self.versions(scopes(**kwargs))}"
+                entry = self.backend.get(key)
+                if entry is None:
+                    response = make_response(view(**kwargs))
+                    if response.status_code != 200:
+                        return response
+                    body = response.get_data()
+                    entry = {
+                        'body': body,
+                        'mimetype': response.mimetype,
+                        'etag': hashlib.sha1(body).hexdigest(),
+                        'last_modified': datetime.now(timezone.utc).replace(microsecond=0)
+                    }
+                    self.backend.set(key, entry, self.ttl)
+                
+                response = app.response_class(entry['body'], mimetype=entry['mimetype'])
+                response.set_etag(entry['etag'])
+                response.last_modified = entry['last_modified']
+                response.cache_control.no_cache = True
+                # Answers If-None-Match / If-Modified-Since with 304 Not Modified
+                return response.make_conditional(request)
+            return wrapper
+        return decorator
+    
+    def fragment(self, name, *scopes, caller):
+        """Jinja helper: {% call cache_fragment('comments', 'post:1') %}...{% endcall %}"""
+        key = f"fragment:{name}|{self.versions(scopes)}"
+        html = self.backend.get(key)
+        if html is None:
+            html = str(caller())
+            self.backend.set(key, html, self.ttl)
+        return Markup(html)
+
+response_cache = ResponseCache(make_cache_backend(app.config['CACHE_BACKEND']), app.config['CACHE_TTL'])
+app.add_template_global(response_cache.fragment, 'cache_fragment')
+
+# Full-text search
+# Posts use rowid 2*id and comments 2*id+1 in the FTS5 table, so the sync
+# triggers can delete by rowid instead of scanning for the row.
+SEARCH_SCHEMA = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+        title, body, kind UNINDEXED, post_id UNINDEXED, tokenize = 'porter unicode61')""",
+    # Titles weigh ten times as much as bodies in the BM25 ranking
+    "INSERT INTO search_index(search_index, rank) VALUES ('rank', 'bm25(10.0, 1.0)')",
+    """CREATE TRIGGER IF NOT EXISTS post_search_insert AFTER INSERT ON post BEGIN
+        INSERT INTO search_index(rowid, title, body, kind, post_id)
+        VALUES (2 * new.id, new.title, new.content, 'post', new.id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS post_search_update AFTER UPDATE OF title, content ON post BEGIN
+        DELETE FROM search_index WHERE rowid = 2 * old.id;
+        INSERT INTO search_index(rowid, title, body, kind, post_id)
+        VALUES (2 * new.id, new.title, new.content, 'post', new.id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS post_search_delete AFTER DELETE ON post BEGIN
+        DELETE FROM search_index WHERE rowid = 2 * old.id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS comment_search_insert AFTER INSERT ON comment BEGIN
+        INSERT INTO search_index(rowid, title, body, kind, post_id)
+        VALUES (2 * new.id + 1, '', new.content, 'comment', new.post_id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS comment_search_update AFTER UPDATE OF content ON comment BEGIN
+        DELETE FROM search_index WHERE rowid = 2 * old.id + 1;
+        INSERT INTO search_index(rowid, title, body, kind, post_id)
+        VALUES (2 * new.id + 1, '', new.content, 'comment', new.post_id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS comment_search_delete AFTER DELETE ON comment BEGIN
+        DELETE FROM search_index WHERE rowid = 2 * old.id + 1;
+    END""",
+]
+
+def add_missing_columns():
+    """Add model columns that existing tables lack; create_all only creates new tables.
+
+    Returns the (table, column) names that were added.
+    """
+    added = set()
+    for table in db.metadata.sorted_tables:
+        existing = {c['name'] for c in sa_inspect(db.engine).get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column.type.compile(db.engine.dialect)}'
+            if column.server_default is not None:
+                ddl += f" DEFAULT '{column.server_default.arg}'"
+                if not column.nullable:
+                    ddl += ' NOT NULL'
+            db.session.execute(text(ddl))
+            added.add((table.name, column.name))
+    return added
+
+def init_db():
+    """Create the tables, the search index and its sync triggers.
+
+    Also upgrades an existing database by adding columns introduced since
+    it was created (filling in the denormalized counters).
+    """
+    db.create_all()
+    # create_all skips indexes of tables that already exist (e.g. the feed index)
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+    added = add_missing_columns()
+    for statement in SEARCH_SCHEMA:
+        db.session.execute(text(statement))
+    db.session.commit()
+    
+    # Counter columns added to a populated database start at 0
+    if {('post', 'comment_count'), ('user', 'post_count')} & added:
+        reconcile_counters()
+
+def search_posts(query, page=1, per_page=10):
+    """Return a page of BM25-ranked hits and whether another page follows."""
+    # Quote every term so user input can never be parsed as FTS5 syntax
+    terms = re.findall(r'\w+', query)
+    if not terms:
+        return [], False
+    match = ' '.join(f'"{t}"' for t in terms)
+    
+    rows = db.session.execute(text("""
+        SELECT s.kind, s.post_id, s.rowid AS ref, post.title AS post_title,
+               snippet(search_index, -1, char(2), char(3), '…', 16) AS snippet
+        FROM search_index AS s JOIN post ON post.id = s.post_id
+        WHERE search_index MATCH :match
+        ORDER BY s.rank
+        LIMIT :limit OFFSET :offset"""),
+        {'match': match, 'limit': per_page + 1, 'offset': (page - 1) * per_page}).all()
+    
+    # Column -1 lets FTS5 take the snippet from whichever column matched best.
+    # Escape the stored text first, then turn the match markers into <mark> tags
+    hits = [{
+        'kind': r.kind,
+        'post_id': r.post_id,
+        'comment_id': r.ref // 2 if r.kind == 'comment' else None,
+        'post_title': r.post_title,
+        'snippet': Markup(str(escape(r.snippet)).replace('\x02', '<mark>').replace('\x03', '</mark>'))
+    } for r in rows[:per_page]]
+    return hits, len(rows) > per_page
+
+# Denormalized counters
+def increment(model, column, id, by=1):
+    """UPDATE model SET column = column + by, in the caller's transaction."""
+    db.session.execute(update(model).where(model.id == id).values({column: column + by}))
+
+def reconcile_counters():
+    """Recount Post.comment_count and User.post_count, fixing only rows that drifted.
+
+    Returns the number of rows repaired per counter.
+    """
+    comments = (db.select(db.func.count(Comment.id))
+                .where(Comment.post_id == Post.id).scalar_subquery())
+    posts = (db.select(db.func.count(Post.id))
+             .where(Post.user_id == User.id).scalar_subquery())
+    
+    repaired = {}
+    for name, model, column, actual in (('post.comment_count', Post, Post.comment_count, comments),
+                                         ('user.post_count', User, User.post_count, posts)):
+        result = db.session.execute(
+            update(model).where(column != actual).values({column: actual}),
+            execution_options={'synchronize_session': False})
+        repaired[name] = result.rowcount
+    db.session.commit()
+    return repaired
+
+# Instrumentation
+class QueryCounter:
+    """Records the SQL statements executed while active.
+
+    Usage in tests:
+        with QueryCounter() as queries:
+            client.get('/')
+        assert queries.count <= 2
+    """
+    def __init__(self):
+        self.statements = []
+        
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+        
+    @property
+    def count(self):
+        return len(self.statements)
+    
+    def __enter__(self):
+        with app.app_context():
+            self.engine = db.engine
+        event.listen(self.engine, 'before_cursor_execute', self._record)
+        return self
+    
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._record)
+
+# Feed pagination
+def encode_cursor(post):
+    raw = f"{post.date_posted.isoformat()}|{post.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        date_posted, post_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(date_posted), int(post_id)
+    except ValueError:
+        abort(400)
+
+def feed_page(cursor=None, per_page=5, page=1):
+    """Return one page of the feed and the cursor of the next page (None on the last).
+
+    Pages seek past the (date_posted, id) of the previous page's last post
+    using the index, so every page costs the same and nothing is counted.
+    """
+    # Load each post's author in the same query instead of one query per post
+    query = Post.query.options(joinedload(Post.author))
+    query = query.order_by(Post.date_posted.desc(), Post.id.desc())
+    if cursor:
+        query = query.filter(tuple_(Post.date_posted, Post.id) < decode_cursor(cursor))
+    elif page > 1:
+        # Numbered ?page= links still work, at the cost of skipping rows
+        query = query.offset((page - 1) * per_page)
+    posts = query.limit(per_page + 1).all()
+    
+    next_cursor = encode_cursor(posts[per_page - 1]) if len(posts) > per_page else None
+    return posts[:per_page], next_cursor
+
+class FeedPage:
+    """One page of the feed, usable where templates expect a Pagination object.
+
+    There is no total count (avoiding it is the point of keyset paging), so
+    iter_pages() only runs up to the next page.
+    """
+    def __init__(self, items, page, per_page, next_cursor):
+        self.items = items
+        self.page = page
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.has_next = next_cursor is not None
+        self.has_prev = page > 1
+        self.next_num = page + 1 if self.has_next else None
+        self.prev_num = page - 1 if self.has_prev else None
+        
+    def __iter__(self):
+        return iter(self.items)
+    
+    def __len__(self):
+        return len(self.items)
+    
+    def iter_pages(self, left_edge=2, left_current=2, right_current=4, right_edge=2):
+        gap = False
+        for num in range(1, (self.next_num or self.page) + 1):
+            if num <= left_edge or self.page - left_current <= num <= self.page + right_current:
+                yield num
+                gap = False
+            elif not gap:
+                yield None
+                gap = True
+
 # Routes
 @app.route('/')
+@response_cache.cached_view(lambda: ['feed'])
 def home():
-    page = request.args.get('page', 1, type=int)
-    posts = Post.query.order_by(Post.date_posted.desc()).paginate(page=page, per_page=5)
-    return render_template('home.html', posts=posts)
+    page = max(request.args.get('page', 1, type=int), 1)
+    posts, next_cursor = feed_page(request.args.get('cursor'), page=page)
+    if not posts and page > 1:
+        abort(404)
+    return render_template('home.html', posts=FeedPage(posts, page, 5, next_cursor), next_cursor=next_cursor)
+
+@app.route('/api/feed')
+def api_feed():
+    per_page = max(1, min(request.args.get('limit', 20, type=int), 100))
+    posts, next_cursor = feed_page(request.args.get('cursor'), per_page)
+    return jsonify({
+        'posts': [{
+            'id': p.id,
+            'title': p.title,
+            'author': p.author.username,
+            'author_post_count': p.author.post_count,
+            'comment_count': p.comment_count,
+            'date_posted': p.date_posted.isoformat()
+        } for p in posts],
+        'next_cursor': next_cursor
+    })
+
+@app.route('/search')
+def search():
+    query = request.args.get('q', '')
+    page = max(request.args.get('page', 1, type=int), 1)
+    results, has_next = search_posts(query, page)
+    return jsonify({
+        'query': query,
+        'page': page,
+        'results': [dict(r, snippet=str(r['snippet'])) for r in results],
+        'has_next': has_next
+    })
 
 @app.route('/register', methods=['GET', 'POST'])
 def register():
@@ -81,6 +717,14 @@ def login():
         user = User.query.filter_by(username=username).first()
         
         if user and user.check_password(password):
+            # Transparently upgrade hashes made with outdated parameters
+            # Skipped when the hash pool is busy; the next login will try again
+            if password_hasher.needs_rehash(user.password_hash):
+                try:
+                    user.set_password(password)
+                    db.session.commit()
+                except HashPoolFull:
+                    pass
             session['user_id'] = user.id
             return redirect(url_for('home'))
         else:
@@ -104,7 +748,9 @@ def new_post():
         
         post = Post(title=title, content=content, user_id=session['user_id'])
         db.session.add(post)
+        increment(User, User.post_count, session['user_id'])
         db.session.commit()
+        response_cache.bump('feed')
         
         flash('Post created successfully!')
         return redirect(url_for('home'))
@@ -112,9 +758,14 @@ def new_post():
     return render_template('create_post.html')
 
 @app.route('/post/<int:post_id>')
+@response_cache.cached_view(lambda post_id: [f'post:{post_id}'])
 def post(post_id):
-    post = Post.query.get_or_404(post_id)
-    html_content = markdown.markdown(post.content)
+    # Author in the same query; comments and their authors in one more
+    post = Post.query.options(
+        joinedload(Post.author),
+        selectinload(Post.comments).joinedload(Comment.author)
+    ).filter_by(id=post_id).first_or_404()
+    html_content = rendered_html(post)
     return render_template('post.html', post=post, content=html_content)
 
 @app.route('/post/<int:post_id>/comment', methods=['POST'])
@@ -125,18 +776,122 @@ def comment_post(post_id):
     post = Post.query.get_or_404(post_id)
     content = request.form['content']
     
+    # Markdown is rendered here, off the writer thread
     comment = Comment(content=content, user_id=session['user_id'], post_id=post_id)
-    db.session.add(comment)
-    db.session.commit()
+    
+    def write(session):
+        session.add(comment)
+        increment(Post, Post.comment_count, post_id)
+    
+    # Waits until the batch holding this comment has been committed
+    comment_writer.submit(write).result(timeout=10)
+    # The feed shows comment counts too
+    response_cache.bump(f'post:{post_id}', 'feed')
     
     flash('Comment added successfully!')
     return redirect(url_for('post', post_id=post_id))
 
+@app.errorhandler(HashPoolFull)
+def hash_pool_full(error):
+    return 'Server busy, please try again shortly.', 503, {'Retry-After': '1'}
+
+@app.route('/metrics')
+def metrics():
+    return jsonify({'password_hashing': password_hasher.metrics()})
+
 @app.template_filter('markdown')
 def markdown_filter(text):
-    return markdown.markdown(text)
+    return render_markdown(text)
+
+app.add_template_global(rendered_html)
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Create the database tables and the search index."""
+    init_db()
+    click.echo('Database initialized')
+
+@app.cli.command('rebuild-search')
+def rebuild_search():
+    """Rebuild the full-text index from the post and comment tables."""
+    init_db()
+    db.session.execute(text("DELETE FROM search_index"))
+    db.session.execute(text("""
+        INSERT INTO search_index(rowid, title, body, kind, post_id)
+        SELECT 2 * id, title, content, 'post', id FROM post"""))
+    db.session.execute(text("""
+        INSERT INTO search_index(rowid, title, body, kind, post_id)
+        SELECT 2 * id + 1, '', content, 'comment', post_id FROM comment"""))
+    db.session.execute(text("INSERT INTO search_index(search_index) VALUES ('optimize')"))
+    db.session.commit()
+    click.echo('Search index rebuilt')
+
+@app.cli.command('reconcile-counters')
+def reconcile_counters_command():
+    """Repair drifted comment and post counters in bulk."""
+    for name, count in reconcile_counters().items():
+        click.echo(f'Repaired {count} {name} values')
+
+@app.cli.command('bench-writes')
+@click.option('--threads', default=8, help='Concurrent writer threads.')
+@click.option('--writes', default=200, help='Comments written per thread.')
+def bench_writes(threads, writes):
+    """Compare comment writes/sec with per-request commits and with group commit."""
+    init_db()
+    user = User.query.filter_by(username='bench').first()
+    if user is None:
+        user = User(username='bench', email='bench@example.invalid')
+        db.session.add(user)
+    post = Post(title='Write benchmark', content='Temporary post for bench-writes', author=user)
+    db.session.add(post)
+    db.session.commit()
+    user_id, post_id = user.id, post.id
+    
+    def direct(i):
+        with app.app_context():
+            db.session.add(Comment(content=f'direct {i}', user_id=user_id, post_id=post_id))
+            db.session.commit()
+    
+    def grouped(i):
+        comment = Comment(content=f'grouped {i}', user_id=user_id, post_id=post_id)
+        comment_writer.submit(lambda session: session.add(comment)).result(timeout=30)
+    
+    for name, write in (('commit per write', direct), ('group commit', grouped)):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(threads) as pool:
+            list(pool.map(write, range(threads * writes)))
+        elapsed = time.perf_counter() - start
+        click.echo(f'{name:>16}: {threads * writes / elapsed:,.0f} writes/sec ({threads} threads)')
+    
+    # Deleting the post cascades to the benchmark comments
+    db.session.delete(db.session.get(Post, post_id))
+    db.session.commit()
+
+@app.cli.command('backfill-markdown')
+@click.option('--batch-size', default=1000, help='Rows rendered and committed per batch.')
+@click.option('--workers', default=None, type=int, help='Render processes (default: CPU count).')
+def backfill_markdown(batch_size, workers):
+    """Render stored HTML for posts and comments that do not have it yet."""
+    with ProcessPoolExecutor(workers) as pool:
+        for model in (Post, Comment):
+            total = 0
+            last_id = 0
+            while True:
+                rows = db.session.execute(
+                    db.select(model.id, model.content)
+                    .where(model.content_html.is_(None), model.id > last_id)
+                    .order_by(model.id).limit(batch_size)).all()
+                if not rows:
+                    break
+                
+                html = pool.map(markdown.markdown, [r.content for r in rows], chunksize=max(1, batch_size // 32))
+                db.session.execute(update(model), [{'id': r.id, 'content_html': h} for r, h in zip(rows, html)])
+                db.session.commit()
+                total += len(rows)
+                last_id = rows[-1].id
+            click.echo(f'Rendered {total} {model.__tablename__} rows')
 
 if __name__ == '__main__':
     with app.app_context():
-        db.create_all()
+        init_db()
     app.run(debug=True)
@@ -1,55 +1,760 @@
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
-from datetime import datetime
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from datetime import datetime, timedelta, timezone
+import argparse
+import collections
+import heapq
+import itertools
+import json
+import queue
+import random
+import sqlite3
+import sys
+import threading
 import time
 import os
 from tabulate import tabulate
 
+class TokenBucket:
+    """Thread-safe token bucket limiting how fast requests are sent."""
+    
+    def __init__(self, rate, capacity):
+        self.rate = rate  # tokens added per second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        
+    def acquire(self):
+        """Block until a token is available, then take it."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class APIClient:
+    """Pooled HTTP client with rate limiting, retries and conditional requests."""
+    
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+    
+    def __init__(self, base_url, requests_per_minute=30, burst=5, max_retries=4,
+                 backoff=1.0, timeout=10, pool_size=10):
+        self.base_url = base_url.rstrip("/")
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.bucket = TokenBucket(requests_per_minute / 60, burst)
+        
+        # One session keeps TCP/TLS connections alive between calls
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({"Accept": "application/json"})
+        
+        # ETag / Last-Modified validators and the body they belong to, per request
+        self.validators = {}
+        self.validators_lock = threading.Lock()
+        
+    def get_json(self, path, params=None):
+        """GET an API path and return the decoded JSON body."""
+        url = f"{self.base_url}{path}"
+        key = (url, tuple(sorted((params or {}).items())))
+        
+        with self.validators_lock:
+            cached = self.validators.get(key)
+        headers = {}
+        if cached:
+            if cached["etag"]:
+                headers["If-None-Match"] = cached["etag"]
+            if cached["last_modified"]:
+                headers["If-Modified-Since"] = cached["last_modified"]
+        
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            try:
+                response = self.session.get(url, params=params, headers=headers, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(self._retry_delay(attempt))
+                continue
+            
+            if response.status_code == 304 and cached:
+                return cached["data"]
+            
+            if response.status_code in self.RETRY_STATUSES and attempt < self.max_retries:
+                time.sleep(self._retry_delay(attempt, response.headers.get("Retry-After")))
+                continue
+            
+            response.raise_for_status()
+            data = response.json()
+            
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+            if etag or last_modified:
+                with self.validators_lock:
+                    self.validators[key] = {"etag": etag, "last_modified": last_modified, "data": data}
+            return data
+        
+    def _retry_delay(self, attempt, retry_after=None):
+        """Seconds to wait before a retry: the server's Retry-After, else jittered exponential backoff."""
+        if retry_after is not None:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        return self.backoff * (2 ** attempt) * (0.5 + random.random() / 2)
+
+class PriceHistoryStore:
+    """SQLite (WAL) cache of daily prices keyed by (currency, vs_currency, date)."""
+    
+    def __init__(self, path="crypto_history.db", recent_days=2, recent_ttl=3600):
+        # Buckets from the last recent_days are refetched once older than
+        # recent_ttl seconds; older buckets are final and never refetched
+        self.recent_days = recent_days
+        self.recent_ttl = recent_ttl
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS price_history (
+                    currency TEXT NOT NULL,
+                    vs_currency TEXT NOT NULL,
+                    date TEXT NOT NULL,
+                    timestamp INTEGER NOT NULL,
+                    price REAL NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    PRIMARY KEY (currency, vs_currency, date)
+                ) WITHOUT ROWID""")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS price_snapshots (
+                    currency TEXT NOT NULL,
+                    vs_currency TEXT NOT NULL,
+                    timestamp INTEGER NOT NULL,
+                    price REAL,
+                    market_cap REAL,
+                    volume_24h REAL,
+                    change_24h REAL,
+                    PRIMARY KEY (currency, vs_currency, timestamp)
+                ) WITHOUT ROWID""")
+            # Earliest date ever requested, so coins with shorter histories are not refetched
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS history_coverage (
+                    currency TEXT NOT NULL,
+                    vs_currency TEXT NOT NULL,
+                    start_date TEXT NOT NULL,
+                    PRIMARY KEY (currency, vs_currency)
+                ) WITHOUT ROWID""")
+    
+    def load(self, currency, vs_currency, start_date):
+        """Return cached rows from start_date onwards."""
+        with self.lock:
+            return pd.read_sql_query(
+                "SELECT date, timestamp, price, fetched_at FROM price_history "
+                "WHERE currency = ? AND vs_currency = ? AND date >= ? ORDER BY date",
+                self.conn, params=(currency, vs_currency, start_date))
+    
+    def iter_history(self, vs_currency="usd", currencies=None, chunk_size=100_000):
+        """Stream cached rows as DataFrame chunks, ordered by currency and date."""
+        wanted = set(currencies) if currencies is not None else None
+        # A separate read connection; WAL lets it run alongside writers
+        conn = sqlite3.connect(self.path)
+        try:
+            for chunk in pd.read_sql_query(
+                    "SELECT currency, vs_currency, date, timestamp, price FROM price_history "
+                    "WHERE vs_currency = ? ORDER BY currency, date",
+                    conn, params=(vs_currency,), chunksize=chunk_size):
+                if wanted is not None:
+                    chunk = chunk[chunk["currency"].isin(wanted)]
+                if not chunk.empty:
+                    yield chunk
+        finally:
+            conn.close()
+    
+    def covered_since(self, currency, vs_currency):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT start_date FROM history_coverage WHERE currency = ? AND vs_currency = ?",
+                (currency, vs_currency)).fetchone()
+        return row[0] if row else None
+    
+    def save(self, currency, vs_currency, prices, start_date):
+        """Upsert [timestamp_ms, price] points and record the requested range."""
+        fetched_at = time.time()
+        rows = [(currency, vs_currency,
+                 datetime.fromtimestamp(ts / 1000, timezone.utc).strftime("%Y-%m-%d"),
+                 int(ts), price, fetched_at) for ts, price in prices]
+        
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO price_history VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (currency, vs_currency, date) DO UPDATE SET "
+                "timestamp = excluded.timestamp, price = excluded.price, fetched_at = excluded.fetched_at",
+                rows)
+            self.conn.execute(
+                "INSERT INTO history_coverage VALUES (?, ?, ?) "
+                "ON CONFLICT (currency, vs_currency) DO UPDATE SET "
+                "start_date = min(start_date, excluded.start_date)",
+                (currency, vs_currency, start_date))
+    
+    def save_snapshots(self, rows):
+        """Insert (currency, vs_currency, timestamp_ms, price, market_cap, volume, change) rows in one transaction."""
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO price_snapshots VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    
+    def missing_days(self, currency, vs_currency, days):
+        """How many trailing days must be fetched to serve a `days` request (0 if none)."""
+        today = datetime.now(timezone.utc).date()
+        start_date = (today - timedelta(days=days)).isoformat()
+        
+        covered = self.covered_since(currency, vs_currency)
+        cached = self.load(currency, vs_currency, start_date)
+        if covered is None or covered > start_date or cached.empty:
+            return days
+        
+        # Refetch from the day after the last cached bucket, or from the
+        # first recent bucket that has outlived its TTL
+        refetch_from = datetime.strptime(cached["date"].iloc[-1], "%Y-%m-%d").date() + timedelta(days=1)
+        recent_cutoff = (today - timedelta(days=self.recent_days - 1)).isoformat()
+        stale = cached[(cached["date"] >= recent_cutoff) & (cached["fetched_at"] < time.time() - self.recent_ttl)]
+        if not stale.empty:
+            refetch_from = min(refetch_from, datetime.strptime(stale["date"].iloc[0], "%Y-%m-%d").date())
+        
+        return max(0, (today - refetch_from).days + 1) if refetch_from <= today else 0
+
+class PriceAnalytics:
+    """Vectorized metrics over many price histories aligned in one 2-D array.
+
+    Rows of `prices` are time buckets of width `freq`, columns are assets;
+    missing observations are NaN.
+    """
+    
+    def __init__(self, histories, freq="1D"):
+        self.assets = list(histories)
+        step = pd.Timedelta(freq).value // 10**6  # bucket width in ms
+        
+        frames = [histories[a] for a in self.assets]
+        empty = [np.empty(0)]  # no histories loaded yet
+        observed = np.concatenate([df["timestamp"].to_numpy(dtype=np.int64) for df in frames] or empty).astype(np.int64)
+        values = np.concatenate([df["price"].to_numpy(dtype=np.float64) for df in frames] or empty)
+        columns = np.repeat(np.arange(len(frames)), [len(df) for df in frames])
+        
+        timestamps = observed // step * step
+        buckets = np.unique(timestamps)
+        rows = np.searchsorted(buckets, timestamps)
+        
+        # Keep only the latest observation of each (bucket, asset) cell, then
+        # scatter them in one assignment (with repeated indices NumPy does not
+        # define which write wins)
+        cells = rows * len(frames) + columns
+        order = np.lexsort((observed, cells))
+        last = np.append(cells[order][1:] != cells[order][:-1], True) if len(order) else order.astype(bool)
+        keep = order[last]
+        self.prices = np.full((len(buckets), len(frames)), np.nan)
+        self.prices[rows[keep], columns[keep]] = values[keep]
+        self.index = pd.to_datetime(buckets, unit="ms")
+        
+    @staticmethod
+    def _rolling_sum(values, window):
+        """Rolling sums over axis 0; windows containing NaN are NaN."""
+        padded = np.zeros((1,) + values.shape[1:])
+        sums = np.concatenate([padded, np.nancumsum(values, axis=0)])
+        counts = np.concatenate([padded, np.cumsum(~np.isnan(values), axis=0)])
+        
+        result = np.full(values.shape, np.nan)
+        full = (counts[window:] - counts[:-window]) == window
+        result[window - 1:] = np.where(full, sums[window:] - sums[:-window], np.nan)
+        return result
+    
+    def returns(self):
+        """Log returns; row t is the return into bucket t (row 0 is NaN)."""
+        with np.errstate(divide="ignore", invalid="ignore"):
+            log_prices = np.log(self.prices)
+        returns = np.full(self.prices.shape, np.nan)
+        returns[1:] = np.diff(log_prices, axis=0)
+        return returns
+    
+    def moving_average(self, window):
+        return self._rolling_sum(self.prices, window) / window
+    
+    def rolling_volatility(self, window, periods_per_year=365):
+        """Annualized rolling standard deviation of log returns."""
+        returns = self.returns()
+        mean = self._rolling_sum(returns, window) / window
+        mean_sq = self._rolling_sum(returns ** 2, window) / window
+        variance = np.maximum(mean_sq - mean ** 2, 0) * window / (window - 1)
+        return np.sqrt(variance * periods_per_year)
+    
+    def drawdown(self):
+        """Fractional distance below the running peak."""
+        return self.prices / np.fmax.accumulate(self.prices, axis=0) - 1
+    
+    def correlation(self):
+        """Pairwise-complete correlation matrix of log returns."""
+        returns = self.returns()
+        mask = (~np.isnan(returns)).astype(np.float64)
+        x = np.nan_to_num(returns)
+        
+        # Sums over the buckets where both assets have a return
+        n = mask.T @ mask
+        sum_x = x.T @ mask
+        sum_xx = (x ** 2).T @ mask
+        sum_xy = x.T @ x
+        
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cov = n * sum_xy - sum_x * sum_x.T
+            corr = cov / np.sqrt((n * sum_xx - sum_x ** 2) * (n * sum_xx.T - sum_x.T ** 2))
+        corr[n < 2] = np.nan
+        return pd.DataFrame(corr, index=self.assets, columns=self.assets)
+    
+    def frame(self, values):
+        """Wrap a (buckets x assets) array as a DataFrame."""
+        return pd.DataFrame(values, index=self.index, columns=self.assets)
+    
+    def summary(self, window=30, periods_per_year=365):
+        """Latest moving average, volatility and drawdown plus max drawdown per asset."""
+        def last_valid(values):
+            valid = ~np.isnan(values)
+            last = values.shape[0] - 1 - np.argmax(valid[::-1], axis=0)
+            return np.where(valid.any(axis=0), values[last, np.arange(values.shape[1])], np.nan)
+        
+        if not len(self.prices):
+            columns = ["price", "total_return", "moving_average", "volatility", "drawdown", "max_drawdown"]
+            return pd.DataFrame(np.nan, index=self.assets, columns=columns)
+        
+        drawdown = self.drawdown()
+        with np.errstate(invalid="ignore"):
+            first = self.prices[np.argmax(~np.isnan(self.prices), axis=0), np.arange(len(self.assets))]
+            return pd.DataFrame({
+                "price": last_valid(self.prices),
+                "total_return": last_valid(self.prices) / first - 1,
+                "moving_average": last_valid(self.moving_average(window)),
+                "volatility": last_valid(self.rolling_volatility(window, periods_per_year)),
+                "drawdown": last_valid(drawdown),
+                "max_drawdown": np.nanmin(drawdown, axis=0)
+            }, index=self.assets)
+
+class AlertScheduler:
+    """Watches many price alerts with one poll per tick.
+
+    Alerts are kept in per-currency heaps: a min-heap of "above" targets and
+    a max-heap of "below" targets, so a new price only touches the alerts it
+    actually crosses.
+    """
+    
+    def __init__(self, tracker, interval=60, vs_currency="usd", max_events=1000):
+        self.tracker = tracker
+        self.interval = interval
+        self.vs_currency = vs_currency
+        self.alerts = {}  # alert id -> alert dict; cancelled ids are skipped lazily in the heaps
+        self.above = {}   # currency -> heap of (target, id)
+        self.below = {}   # currency -> heap of (-target, id)
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        # Bounded: when nobody reads events() the oldest fired alerts are dropped
+        self.fired = queue.Queue(maxsize=max_events)
+        self.stop_event = threading.Event()
+        self.thread = None
+        
+    def add(self, currency, target_price, alert_type="above", callback=None):
+        """Register an alert and return its id."""
+        alert_id = next(self.ids)
+        alert = {"id": alert_id, "currency": currency, "target": target_price,
+                 "type": alert_type, "callback": callback}
+        
+        with self.lock:
+            self.alerts[alert_id] = alert
+            if alert_type == "above":
+                heapq.heappush(self.above.setdefault(currency, []), (target_price, alert_id))
+            else:
+                heapq.heappush(self.below.setdefault(currency, []), (-target_price, alert_id))
+        return alert_id
+    
+    def cancel(self, alert_id):
+        """Cancel a pending alert."""
+        with self.lock:
+            return self.alerts.pop(alert_id, None) is not None
+    
+    def currencies(self):
+        """Currencies that still have pending alerts."""
+        with self.lock:
+            return sorted({alert["currency"] for alert in self.alerts.values()})
+    
+    def check(self, prices):
+        """Fire every alert crossed by the given {currency: price} mapping."""
+        fired = []
+        with self.lock:
+            for currency, price in prices.items():
+                above = self.above.get(currency, [])
+                while above and above[0][0] <= price:
+                    fired.append(self.alerts.pop(heapq.heappop(above)[1], None))
+                
+                below = self.below.get(currency, [])
+                while below and -below[0][0] >= price:
+                    fired.append(self.alerts.pop(heapq.heappop(below)[1], None))
+        
+        fired = [alert for alert in fired if alert is not None]
+        for alert in fired:
+            alert["price"] = prices[alert["currency"]]
+            self._publish(alert)
+            # The alerts are already popped, so one failing callback must not lose the rest
+            if alert["callback"]:
+                try:
+                    alert["callback"](alert)
+                except Exception as e:
+                    print(f"Error in alert callback for {alert['currency']}: {e}")
+        return fired
+    
+    def _publish(self, alert):
+        while True:
+            try:
+                self.fired.put_nowait(alert)
+                return
+            except queue.Full:
+                try:
+                    self.fired.get_nowait()
+                except queue.Empty:
+                    pass
+    
+    def tick(self):
+        """Poll once for the union of watched currencies and fire crossed alerts."""
+        currencies = self.currencies()
+        if not currencies:
+            return []
+        
+        data = self.tracker.fetch_current_prices(self.vs_currency, ids=currencies)
+        if not data:
+            return []
+        
+        prices = {c: v[self.vs_currency] for c, v in data.items() if self.vs_currency in v}
+        return self.check(prices)
+    
+    def start(self):
+        """Run the polling loop in a background thread."""
+        if self.thread and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+    
+    def stop(self):
+        self.stop_event.set()
+    
+    def _run(self):
+        while not self.stop_event.is_set():
+            try:
+                self.tick()
+            except Exception as e:
+                print(f"Error checking alerts: {e}")
+            self.stop_event.wait(self.interval)
+    
+    def events(self, timeout=None):
+        """Iterate over fired alerts as they happen until the scheduler stops."""
+        while not self.stop_event.is_set():
+            try:
+                yield self.fired.get(timeout=timeout or self.interval)
+            except queue.Empty:
+                continue
+
+class ChartRenderer:
+    """Reusable price chart that downsamples each series to the figure's pixel width."""
+    
+    def __init__(self, width_px=1200, height_px=600, dpi=100, method="lttb", headless=False):
+        self.width_px = width_px
+        self.method = method
+        self.headless = headless
+        figsize = (width_px / dpi, height_px / dpi)
+        if headless:
+            # A standalone figure on an Agg canvas renders to files only and
+            # leaves the pyplot backend (and later interactive charts) alone
+            self.fig = Figure(figsize=figsize, dpi=dpi)
+            FigureCanvasAgg(self.fig)
+            self.ax = self.fig.add_subplot()
+        else:
+            self.fig, self.ax = plt.subplots(figsize=figsize, dpi=dpi)
+        self.ax.set_xlabel("Date")
+        self.ax.grid(True, alpha=0.3)
+        self.lines = {}
+        
+    @staticmethod
+    def lttb(x, y, n_out):
+        """Largest-Triangle-Three-Buckets: indices of n_out points preserving the visual shape."""
+        n = len(x)
+        if n_out >= n or n_out < 3:
+            return np.arange(n)
+        
+        edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+        selected = np.empty(n_out, dtype=np.int64)
+        selected[0], selected[-1] = 0, n - 1
+        a = 0
+        for i in range(n_out - 2):
+            lo, hi = edges[i], edges[i + 1]
+            next_lo, next_hi = (edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else (n - 1, n)
+            avg_x, avg_y = x[next_lo:next_hi].mean(), y[next_lo:next_hi].mean()
+            
+            # Keep the point forming the largest triangle with the previous pick and the next bucket's mean
+            area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+            a = lo + int(np.argmax(area))
+            selected[i + 1] = a
+        return selected
+    
+    @staticmethod
+    def minmax(x, y, n_out):
+        """Indices of the minimum and maximum of each of n_out // 2 equal-width buckets."""
+        n = len(x)
+        buckets = n_out // 2
+        if n_out >= n or buckets < 1:
+            return np.arange(n)
+        
+        bucket = np.repeat(np.arange(buckets), np.diff(np.linspace(0, n, buckets + 1).astype(np.int64)))
+        # Sorting by (bucket, value) puts each bucket's min first and max last
+        order = np.lexsort((y, bucket))
+        starts = np.searchsorted(bucket[order], np.arange(buckets))
+        ends = np.append(starts[1:], n) - 1
+        return np.unique(np.concatenate([order[starts], order[ends]]))
+    
+    def render(self, histories, title="", save_path=None):
+        """Draw {label: DataFrame(date, price)} series, updating existing lines in place."""
+        for label in list(self.lines):
+            if label not in histories:
+                self.lines.pop(label).remove()
+        
+        for label, df in histories.items():
+            df = df.dropna(subset=["price"])
+            x = df["date"].to_numpy(dtype="datetime64[ms]").astype(np.int64).astype(np.float64)
+            y = df["price"].to_numpy(dtype=np.float64)
+            
+            if self.method == "lttb":
+                keep = self.lttb(x, y, self.width_px)
+            elif self.method == "minmax":
+                keep = self.minmax(x, y, self.width_px)
+            else:
+                keep = np.arange(len(x))
+            dates = df["date"].to_numpy()[keep]
+            
+            if label in self.lines:
+                self.lines[label].set_data(dates, y[keep])
+            else:
+                self.lines[label], = self.ax.plot(dates, y[keep], label=label)
+        
+        self.ax.relim()
+        self.ax.autoscale_view()
+        self.ax.set_title(title)
+        self.ax.legend()
+        self.fig.tight_layout()
+        self.fig.canvas.draw_idle()
+        
+        if save_path:
+            self.fig.savefig(save_path)
+        return self.fig
+
+class PriceCollector:
+    """Headless collector sampling current prices on a fixed schedule.
+
+    Samples are buffered and written to the store in batches. The latest
+    snapshot and fetch metrics are served as JSON on /latest and /metrics.
+    """
+    
+    def __init__(self, tracker, interval=60, vs_currency="usd", flush_interval=300,
+                 host="127.0.0.1", port=8765):
+        self.tracker = tracker
+        self.interval = interval
+        self.vs_currency = vs_currency
+        self.flush_interval = flush_interval
+        self.address = (host, port)
+        
+        self.lock = threading.Lock()
+        self.snapshot = {"timestamp": None, "prices": {}}
+        self.pending = []
+        self.last_flush = time.monotonic()
+        self.latencies = collections.deque(maxlen=1000)
+        self.fetches = 0
+        self.errors = 0
+        self.stop_event = threading.Event()
+        
+    def tick(self):
+        """Take one sample and buffer it for the store."""
+        start = time.perf_counter()
+        data = self.tracker.fetch_current_prices(self.vs_currency)
+        latency = time.perf_counter() - start
+        now = time.time()
+        
+        with self.lock:
+            self.fetches += 1
+            self.latencies.append(latency)
+            if not data:
+                self.errors += 1
+                return
+            
+            self.snapshot = {"timestamp": now, "prices": data}
+            v = self.vs_currency
+            self.pending.extend(
+                (currency, v, int(now * 1000), d.get(v), d.get(f"{v}_market_cap"),
+                 d.get(f"{v}_24h_vol"), d.get(f"{v}_24h_change"))
+                for currency, d in data.items())
+        
+        if time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+    
+    def flush(self):
+        """Write buffered samples to the store in one transaction."""
+        with self.lock:
+            rows, self.pending = self.pending, []
+        self.last_flush = time.monotonic()
+        if rows and self.tracker.store is not None:
+            self.tracker.store.save_snapshots(rows)
+    
+    def metrics(self):
+        with self.lock:
+            latencies = np.array(self.latencies) * 1000
+            return {
+                "fetches": self.fetches,
+                "errors": self.errors,
+                "error_rate": self.errors / self.fetches if self.fetches else 0.0,
+                "latency_ms": {
+                    "mean": float(latencies.mean()) if len(latencies) else None,
+                    "p50": float(np.percentile(latencies, 50)) if len(latencies) else None,
+                    "p95": float(np.percentile(latencies, 95)) if len(latencies) else None,
+                    "max": float(latencies.max()) if len(latencies) else None
+                },
+                "pending_rows": len(self.pending),
+                "last_sample": self.snapshot["timestamp"]
+            }
+    
+    def latest(self):
+        with self.lock:
+            return self.snapshot
+    
+    def _make_handler(self):
+        collector = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                routes = {"/latest": collector.latest, "/metrics": collector.metrics}
+                if self.path not in routes:
+                    self.send_error(404)
+                    return
+                body = json.dumps(routes[self.path]()).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def log_message(self, format, *args):
+                pass
+        
+        return Handler
+    
+    def run(self):
+        """Sample until stopped, serving the snapshot endpoint in a background thread."""
+        server = ThreadingHTTPServer(self.address, self._make_handler())
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"Collecting every {self.interval}s; serving http://{self.address[0]}:{server.server_port}/latest")
+        
+        # Ticks are scheduled on a fixed grid so fetch time does not accumulate as drift;
+        # ticks missed while a fetch overran are skipped rather than run back to back
+        next_tick = time.monotonic()
+        try:
+            while not self.stop_event.is_set():
+                self.tick()
+                next_tick += self.interval
+                now = time.monotonic()
+                if now > next_tick:
+                    next_tick += self.interval * ((now - next_tick) // self.interval + 1)
+                self.stop_event.wait(next_tick - now)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.flush()
+            server.shutdown()
+            server.server_close()
+    
+    def stop(self):
+        self.stop_event.set()
+
 class CryptoPriceTracker:
-    def __init__(self):
-        self.api_url = "https://api.coingecko.com/api/v3"
+    def __init__(self, api_url="https://api.coingecko.com/api/v3", client=None, history_path="crypto_history.db"):
+        self.api_url = api_url
+        self.client = client or APIClient(api_url)
+        self.store = PriceHistoryStore(history_path) if history_path else None
         self.currencies = ["bitcoin", "ethereum", "solana", "cardano", "dogecoin"]
         self.prices_history = {}
         self.current_prices = {}
+        self.alerts = AlertScheduler(self)
+        self.chart = None
         
-    def fetch_current_prices(self, vs_currency="usd"):
-        """Fetch current prices for selected cryptocurrencies."""
-        currencies_str = ",".join(self.currencies)
-        endpoint = f"{self.api_url}/simple/price"
-        params = {
-            "ids": currencies_str,
-            "vs_currencies": vs_currency,
-            "include_market_cap": "true",
-            "include_24hr_vol": "true",
-            "include_24hr_change": "true"
-        }
+    def fetch_current_prices(self, vs_currency="usd", ids=None, batch_size=250, max_workers=4):
+        """Fetch current prices for selected cryptocurrencies (or the given ids)."""
+        currencies = list(ids or self.currencies)
+        
+        def fetch_batch(batch):
+            params = {
+                "ids": ",".join(batch),
+                "vs_currencies": vs_currency,
+                "include_market_cap": "true",
+                "include_24hr_vol": "true",
+                "include_24hr_change": "true"
+            }
+            return self.client.get_json("/simple/price", params)
         
         try:
-            response = requests.get(endpoint, params=params)
-            data = response.json()
+            # Long id lists are split to keep each request URL within API limits
+            batches = [currencies[i:i + batch_size] for i in range(0, len(currencies), batch_size)]
+            data = {}
+            with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(batches)))) as pool:
+                for result in pool.map(fetch_batch, batches):
+                    data.update(result)
             
-            self.current_prices = data
+            if ids is None:
+                self.current_prices = data
             return data
         except Exception as e:
             print(f"Error fetching current prices: {e}")
             return None
     
     def fetch_historical_data(self, currency="bitcoin", days=30, vs_currency="usd"):
-        """Fetch historical data for a cryptocurrency."""
-        endpoint = f"{self.api_url}/coins/{currency}/market_chart"
-        params = {
-            "vs_currency": vs_currency,
-            "days": days,
-            "interval": "daily"
-        }
+        """Fetch historical data for a cryptocurrency, requesting only what the local store lacks."""
+        fetch_days = days if self.store is None else self.store.missing_days(currency, vs_currency, days)
         
         try:
-            response = requests.get(endpoint, params=params)
-            data = response.json()
+            if fetch_days:
+                params = {
+                    "vs_currency": vs_currency,
+                    "days": fetch_days,
+                    "interval": "daily"
+                }
+                data = self.client.get_json(f"/coins/{currency}/market_chart", params)
+            
+            if self.store is None:
+                # Convert to DataFrame
+                prices = pd.DataFrame(data["prices"], columns=["timestamp", "price"])
+            else:
+                start_date = (datetime.now(timezone.utc).date() - timedelta(days=days)).isoformat()
+                if fetch_days:
+                    self.store.save(currency, vs_currency, data["prices"],
+                                    (datetime.now(timezone.utc).date() - timedelta(days=fetch_days)).isoformat())
+                prices = self.store.load(currency, vs_currency, start_date)[["timestamp", "price"]]
             
-            # Convert to DataFrame
-            prices = pd.DataFrame(data["prices"], columns=["timestamp", "price"])
             prices["date"] = pd.to_datetime(prices["timestamp"], unit="ms")
             
             self.prices_history[currency] = prices
@@ -58,6 +763,22 @@ class CryptoPriceTracker:
             print(f"Error fetching historical data: {e}")
             return None
     
+    def fetch_many_historical(self, currencies, days=30, vs_currency="usd", max_workers=8):
+        """Fetch historical data for several cryptocurrencies concurrently."""
+        currencies = list(dict.fromkeys(currencies))
+        if not currencies:
+            return {}
+        
+        # The client's token bucket still spaces out the requests across threads
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(currencies))) as pool:
+            frames = pool.map(lambda c: self.fetch_historical_data(c, days, vs_currency), currencies)
+            return {c: df for c, df in zip(currencies, frames) if df is not None}
+    
+    def analytics(self, currencies=None, freq="1D"):
+        """Align the loaded histories into a PriceAnalytics object."""
+        currencies = currencies or list(self.prices_history)
+        return PriceAnalytics({c: self.prices_history[c] for c in currencies if c in self.prices_history}, freq)
+    
     def display_current_prices(self):
         """Display current prices in a formatted table."""
         if not self.current_prices:
@@ -83,84 +804,138 @@ class CryptoPriceTracker:
                 
         print("\n" + tabulate(table_data, headers=headers, tablefmt="pretty") + "\n")
     
-    def plot_historical_data(self, currencies=None, days=30):
-        """Plot historical price data for specified cryptocurrencies."""
+    def plot_historical_data(self, currencies=None, days=30, save_path=None, show=True,
+                             headless=False, method="lttb", width_px=1200):
+        """Plot historical price data for specified cryptocurrencies.
+
+        The figure is reused between calls; each series is downsampled to
+        width_px points first. headless renders with Agg and never shows.
+        """
         if currencies is None:
             currencies = self.currencies[:3]  # Default to top 3
             
-        plt.figure(figsize=(12, 6))
+        # Request every missing history at once instead of one round trip per coin
+        self.fetch_many_historical([c for c in currencies if c not in self.prices_history], days)
         
-        for currency in currencies:
-            if currency not in self.prices_history:
-                self.fetch_historical_data(currency, days)
-                
-            if currency in self.prices_history:
-                df = self.prices_history[currency]
-                plt.plot(df["date"], df["price"], label=currency.capitalize())
+        # A figure is only rebuilt when its size or backend changes, or its window was closed
+        if (self.chart is None or self.chart.width_px != width_px or self.chart.headless != headless
+                or (not headless and not plt.fignum_exists(self.chart.fig.number))):
+            self.chart = ChartRenderer(width_px=width_px, method=method, headless=headless)
+        self.chart.method = method
+        self.chart.ax.set_ylabel("Price (USD)")
         
-        plt.title(f"Cryptocurrency Prices - Last {days} Days")
-        plt.xlabel("Date")
-        plt.ylabel("Price (USD)")
-        plt.legend()
-        plt.grid(True, alpha=0.3)
-        plt.tight_layout()
+        histories = {c.capitalize(): self.prices_history[c] for c in currencies if c in self.prices_history}
         
         # Save and show plot
-        plot_file = f"crypto_prices_{datetime.now().strftime('%Y%m%d%H%M%S')}.png"
-        plt.savefig(plot_file)
+        plot_file = save_path or f"crypto_prices_{datetime.now().strftime('%Y%m%d%H%M%S')}.png"
+        self.chart.render(histories, f"Cryptocurrency Prices - Last {days} Days", plot_file)
         print(f"Plot saved as {plot_file}")
-        plt.show()
+        if show and not headless:
+            plt.show()
         
+    def add_alert(self, currency, target_price, alert_type="above", callback=None):
+        """Register a price alert that is checked in the background."""
+        alert_id = self.alerts.add(currency, target_price, alert_type, callback)
+        self.alerts.start()
+        return alert_id
+    
     def set_alert(self, currency, target_price, alert_type="above"):
-        """Set a price alert for a cryptocurrency."""
+        """Set a price alert for a cryptocurrency and wait until it fires."""
         print(f"Alert set for {currency}: {alert_type} ${target_price}")
         
-        while True:
-            current = self.fetch_current_prices()
-            
-            if current and currency in current:
-                current_price = current[currency]["usd"]
-                
-                print(f"{currency.capitalize()} current price: ${current_price:,.2f}", end="\r")
-                
-                if (alert_type == "above" and current_price >= target_price) or \
-                   (alert_type == "below" and current_price <= target_price):
-                    print(f"\nALERT: {currency.capitalize()} is now ${current_price:,.2f}!")
-                    break
+        fired = queue.Queue()
+        alert_id = self.add_alert(currency, target_price, alert_type, fired.put)
+        try:
+            alert = fired.get()
+        finally:
+            self.alerts.cancel(alert_id)
+        
+        print(f"\nALERT: {currency.capitalize()} is now ${alert['price']:,.2f}!")
+        
+    def export_data(self, format="csv", include_history=False, vs_currency="usd", chunk_size=100_000):
+        """Export cryptocurrency data to a file.
+
+        Current prices go to crypto_prices_<time>.<ext>. With include_history,
+        cached histories are streamed in chunks to crypto_history_<time>.<ext>.
+        """
+        now = datetime.now()
+        stamp = now.strftime("%Y%m%d%H%M%S")
+        
+        # The cache only holds the currency of the last refresh
+        if not self.current_prices or any(vs_currency not in d for d in self.current_prices.values()):
+            self.fetch_current_prices(vs_currency)
             
-            time.sleep(60)  # Check every minute
+        # Export current prices, building each column once
+        rows = [(c, self.current_prices[c]) for c in self.currencies
+                if c in self.current_prices and vs_currency in self.current_prices[c]]
+        df_current = pd.DataFrame({
+            "currency": [c for c, _ in rows],
+            f"price_{vs_currency}": [d[vs_currency] for _, d in rows],
+            "change_24h": [d[f"{vs_currency}_24h_change"] for _, d in rows],
+            "market_cap": [d[f"{vs_currency}_market_cap"] for _, d in rows],
+            "volume_24h": [d[f"{vs_currency}_24h_vol"] for _, d in rows],
+            "timestamp": now
+        })
+        
+        filename = self._write_chunks([df_current], f"crypto_prices_{stamp}", format)
+        if filename:
+            print(f"Data exported to {filename}")
+        
+        if include_history:
+            if self.store is not None:
+                chunks = self.store.iter_history(vs_currency, self.currencies, chunk_size)
+            else:
+                chunks = (df.assign(currency=c) for c, df in self.prices_history.items())
             
-    def export_data(self, format="csv"):
-        """Export cryptocurrency data to a file."""
-        now = datetime.now().strftime("%Y%m%d%H%M%S")
+            filename = self._write_chunks(chunks, f"crypto_history_{stamp}", format)
+            if filename:
+                print(f"History exported to {filename}")
+    
+    @staticmethod
+    def _write_chunks(chunks, basename, format):
+        """Write DataFrame chunks to one file without holding them all in memory."""
+        extensions = {"csv": "csv", "jsonl": "jsonl", "parquet": "parquet", "excel": "xlsx"}
+        if format not in extensions:
+            print(f"Unsupported export format: {format}")
+            return None
+        filename = f"{basename}.{extensions[format]}"
         
-        if not self.current_prices:
-            self.fetch_current_prices()
+        # Nothing to write (e.g. no history cached yet): create no file
+        chunks = iter(chunks)
+        first = next(chunks, None)
+        if first is None:
+            print(f"No data to export to {filename}")
+            return None
+        chunks = itertools.chain([first], chunks)
+        
+        if format == "excel":
+            # Excel files cannot be appended to, so this format is written in one go
+            pd.concat(list(chunks), ignore_index=True).to_excel(filename, index=False)
+        elif format == "parquet":
+            try:
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+            except ImportError:
+                print("Exporting Parquet requires pyarrow. Please install it first.")
+                return None
             
-        # Export current prices
-        df_current = pd.DataFrame()
+            writer = None
+            for chunk in chunks:
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(filename, table.schema)
+                writer.write_table(table)
+            if writer is not None:
+                writer.close()
+        else:
+            with open(filename, "w", newline="", encoding="utf-8") as f:
+                for i, chunk in enumerate(chunks):
+                    if format == "csv":
+                        chunk.to_csv(f, index=False, header=i == 0)
+                    else:
+                        chunk.to_json(f, orient="records", lines=True, date_format="iso")
         
-        for currency in self.currencies:
-            if currency in self.current_prices:
-                data = self.current_prices[currency]
-                temp_df = pd.DataFrame({
-                    "currency": [currency],
-                    "price_usd": [data["usd"]],
-                    "change_24h": [data["usd_24h_change"]],
-                    "market_cap": [data["usd_market_cap"]],
-                    "volume_24h": [data["usd_24h_vol"]],
-                    "timestamp": [datetime.now()]
-                })
-                df_current = pd.concat([df_current, temp_df])
-        
-        if format == "csv":
-            filename = f"crypto_prices_{now}.csv"
-            df_current.to_csv(filename, index=False)
-        elif format == "excel":
-            filename = f"crypto_prices_{now}.xlsx"
-            df_current.to_excel(filename, index=False)
-            
-        print(f"Data exported to {filename}")
+        return filename
 
 def main():
     tracker = CryptoPriceTracker()
@@ -199,19 +974,19 @@ def main():
                 print("Invalid alert type. Setting to 'above'.")
                 alert_type = 'above'
                 
-            print(f"Starting alert for {currency}. Press Ctrl+C to cancel.")
-            try:
-                tracker.set_alert(currency, target_price, alert_type)
-            except KeyboardInterrupt:
-                print("\nAlert canceled.")
+            # Alerts are checked in the background so the menu stays usable
+            tracker.add_alert(currency, target_price, alert_type,
+                              lambda alert: print(f"\nALERT: {alert['currency'].capitalize()} is now ${alert['price']:,.2f}!"))
+            print(f"Alert set for {currency}: {alert_type} ${target_price}")
                 
         elif choice == '4':
-            format_type = input("Export as 'csv' or 'excel'? ").lower()
-            if format_type not in ['csv', 'excel']:
+            format_type = input("Export as 'csv', 'excel', 'jsonl' or 'parquet'? ").lower()
+            if format_type not in ['csv', 'excel', 'jsonl', 'parquet']:
                 print("Invalid format. Using CSV.")
                 format_type = 'csv'
+            include_history = input("Include price history? (y/n) ").lower() == 'y'
                 
-            tracker.export_data(format_type)
+            tracker.export_data(format_type, include_history)
             
         elif choice == '5':
             print("Thank you for using the Cryptocurrency Price Tracker!")
@@ -220,5 +995,29 @@ def main():
         else:
             print("Invalid choice. Please try again.")
 
+def run_cli(argv):
+    parser = argparse.ArgumentParser(description="Cryptocurrency Price Tracker headless tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    
+    collect = commands.add_parser("collect", help="Sample current prices on a schedule")
+    collect.add_argument("--interval", type=float, default=60, help="Seconds between samples")
+    collect.add_argument("--currencies", help="Comma-separated coin ids (default: tracker defaults)")
+    collect.add_argument("--vs-currency", default="usd")
+    collect.add_argument("--db", default="crypto_history.db", help="SQLite store for samples")
+    collect.add_argument("--flush-interval", type=float, default=300, help="Seconds between batched writes")
+    collect.add_argument("--host", default="127.0.0.1")
+    collect.add_argument("--port", type=int, default=8765, help="Port for /latest and /metrics")
+    
+    args = parser.parse_args(argv)
+    if args.command == "collect":
+        tracker = CryptoPriceTracker(history_path=args.db)
+        if args.currencies:
+            tracker.currencies = [c.strip().lower() for c in args.currencies.split(",")]
+        PriceCollector(tracker, args.interval, args.vs_currency, args.flush_interval,
+                       args.host, args.port).run()
+
 if __name__ == "__main__":
-    main()
+    if len(sys.argv) > 1:
+        run_cli(sys.argv[1:])
+    else:
+        main()
@@ -2,81 +2,486 @@ import pandas as pd
 import numpy as np
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
+from pandas.api.types import union_categoricals
 import matplotlib.pyplot as plt
+from scipy import sparse
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+
+class TitleIndex:
+    """Character trigram index over movie titles for fuzzy lookups"""
+    
+    def __init__(self, titles=None, cache_size=4096, max_candidates=5000):
+        self.gram_ids = {}
+        self.max_candidates = max_candidates
+        if titles is not None:
+            self.build(titles)
+        # Repeated misspellings are answered from the cache
+        self.search = lru_cache(maxsize=cache_size)(self._search)
+    
+    @staticmethod
+    def _grams(title):
+        """Return the set of padded character trigrams of a title"""
+        text = f"  {' '.join(str(title).lower().split())} "
+        return {text[i:i + 3] for i in range(len(text) - 2)}
+    
+    def build(self, titles, chunk_size=100_000):
+        """Build the inverted lists (CSR layout: gram -> sorted title positions)"""
+        titles = pd.Series(np.asarray(titles, dtype=object), dtype=object)
+        gram_column, title_column = [np.empty(0, dtype=np.int32)], [np.empty(0, dtype=np.int32)]
+        for start in range(0, len(titles), chunk_size):
+            grams, rows = self._gram_pairs(titles.iloc[start:start + chunk_size])
+            gram_column.append(grams)
+            title_column.append(rows + start)
+        
+        gram_column, title_column = np.concatenate(gram_column), np.concatenate(title_column)
+        incidence = sparse.csr_matrix((np.ones(len(gram_column), dtype=np.int32), (title_column, gram_column)),
+                                      shape=(len(titles), len(self.gram_ids)))
+        incidence.sum_duplicates()
+        self._set_incidence(incidence)
+    
+    def _set_incidence(self, incidence):
+        """Store a title x gram matrix as forward (title -> grams) and inverted lists"""
+        self.forward = incidence.indices.astype(np.int32)
+        self.forward_indptr = incidence.indptr.astype(np.int64)
+        self.lengths = np.diff(self.forward_indptr).astype(np.int32)
+        # Converting to CSC is a linear-time counting sort that leaves every
+        # posting list in ascending title order
+        columns = incidence.tocsc()
+        self.postings = columns.indices.astype(np.int32)
+        self.indptr = columns.indptr.astype(np.int64)
+    
+    def _incidence(self):
+        return sparse.csr_matrix((np.ones(len(self.forward), dtype=np.int32), self.forward, self.forward_indptr),
+                                 shape=(len(self.lengths), len(self.gram_ids)))
+    
+    def _gram_pairs(self, titles):
+        """Return (gram id, title row) pairs of a chunk, repeats included
+
+        Same trigrams as _grams, but extracted with array operations: every
+        trigram is packed into one integer from its three code points.
+        """
+        texts = '  ' + titles.map(str).str.lower().str.split().str.join(' ') + ' '
+        sizes = texts.str.len().to_numpy()
+        chars = np.frombuffer(''.join(texts).encode('utf-32-le'), dtype=np.uint32).astype(np.int64)
+        rows = np.repeat(np.arange(len(sizes), dtype=np.int32), sizes)
+        
+        # Code points fit in 21 bits; keep trigrams that do not cross into the next title
+        codes = (chars[:-2] << 42) | (chars[1:-1] << 21) | chars[2:]
+        valid = rows[:-2] == rows[2:]
+        codes, rows = codes[valid], rows[:-2][valid]
+        
+        # Look up each distinct packed trigram in the dictionary once
+        inverse, uniques = pd.factorize(codes)
+        mask = (1 << 21) - 1
+        ids = np.array([self.gram_ids.setdefault(chr(c >> 42) + chr((c >> 21) & mask) + chr(c & mask), len(self.gram_ids))
+                        for c in uniques.tolist()], dtype=np.int32)
+        return ids[inverse], rows
+    
+    def add(self, titles):
+        """Append titles, merging their trigrams into the existing lists"""
+        new = TitleIndex()
+        new.gram_ids = self.gram_ids
+        new.build(titles)
+        
+        # Old rows were sized before the new titles could add grams
+        old = self._incidence()
+        old.resize((old.shape[0], len(self.gram_ids)))
+        self._set_incidence(sparse.vstack([old, new._incidence()], format='csr'))
+        self.search.cache_clear()
+    
+    def save(self, path):
+        """Write the index arrays to a model directory"""
+        grams = sorted(self.gram_ids, key=self.gram_ids.get)
+        with open(os.path.join(path, 'title_grams.json'), 'w', encoding='utf-8') as f:
+            json.dump(grams, f)
+        np.save(os.path.join(path, 'title_postings.npy'), self.postings)
+        np.save(os.path.join(path, 'title_indptr.npy'), self.indptr)
+        np.save(os.path.join(path, 'title_forward.npy'), self.forward)
+        np.save(os.path.join(path, 'title_forward_indptr.npy'), self.forward_indptr)
+    
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """Load an index written by save, memory-mapping the arrays"""
+        index = cls()
+        with open(os.path.join(path, 'title_grams.json'), encoding='utf-8') as f:
+            index.gram_ids = {g: i for i, g in enumerate(json.load(f))}
+        index.postings = np.load(os.path.join(path, 'title_postings.npy'), mmap_mode=mmap_mode)
+        index.indptr = np.load(os.path.join(path, 'title_indptr.npy'), mmap_mode=mmap_mode)
+        index.forward = np.load(os.path.join(path, 'title_forward.npy'), mmap_mode=mmap_mode)
+        index.forward_indptr = np.load(os.path.join(path, 'title_forward_indptr.npy'), mmap_mode=mmap_mode)
+        index.lengths = np.diff(index.forward_indptr).astype(np.int32)
+        return index
+    
+    def _search(self, query, limit=5, min_score=0.5):
+        """Return (position, score) pairs of the best matching titles by trigram Dice score"""
+        grams = self._grams(query)
+        ids = [self.gram_ids[g] for g in grams if g in self.gram_ids]
+        
+        # A title scoring >= min_score must share at least this many trigrams
+        needed = max(1, int(np.ceil(min_score * len(grams) / (2 - min_score))))
+        if len(ids) < needed:
+            return ()
+        
+        # Length band: the score bound also limits how many trigrams a match can have
+        low = needed
+        high = int(np.floor(len(grams) * (2 - min_score) / min_score))
+        
+        # Pigeonhole: every match appears in one of the rarest len(ids) - needed + 1
+        # lists, so only those generate candidates. Shared trigrams ("sam", " (1")
+        # can make those lists cover most of the catalogue, so generation stops at
+        # max_candidates postings; past that cap the result is approximate.
+        lists = sorted((self.postings[self.indptr[g]:self.indptr[g + 1]] for g in ids), key=len)
+        generators = []
+        total = 0
+        for posting in lists[:len(lists) - needed + 1]:
+            if generators and total + len(posting) > self.max_candidates:
+                break
+            generators.append(posting[:self.max_candidates])
+            total += len(generators[-1])
+        
+        candidates = np.unique(np.concatenate(generators))
+        counts = self.lengths[candidates]
+        keep = (counts >= low) & (counts <= high)
+        candidates, counts = candidates[keep], counts[keep]
+        
+        # Exact overlap from each candidate's own trigrams, gathered in one pass
+        in_query = np.zeros(len(self.gram_ids), dtype=bool)
+        in_query[ids] = True
+        ends = np.cumsum(counts)
+        positions = np.repeat(self.forward_indptr[candidates] - (ends - counts), counts) + np.arange(ends[-1] if len(ends) else 0)
+        common = np.bincount(np.repeat(np.arange(len(candidates)), counts),
+                             weights=in_query[self.forward[positions]], minlength=len(candidates))
+        
+        scores = 2 * common / (len(grams) + self.lengths[candidates])
+        keep = scores >= min_score
+        candidates, scores = candidates[keep], scores[keep]
+        order = np.lexsort((candidates, -scores))[:limit]
+        return tuple(zip(candidates[order].tolist(), scores[order].tolist()))
+
+class RandomProjectionLSH:
+    """Random-hyperplane LSH for cosine similarity
+
+    More tables raise recall, more bits per table shrink the buckets, and
+    max_candidates caps how many movies are re-ranked exactly per query.
+    """
+    
+    def __init__(self, n_tables=8, n_bits=12, max_candidates=2000, seed=0):
+        self.n_tables = n_tables
+        self.n_bits = n_bits
+        self.max_candidates = max_candidates
+        self.seed = seed
+    
+    def _codes(self, matrix):
+        """Hash each row to one integer bucket code per table"""
+        weights = 1 << np.arange(self.n_bits, dtype=np.int64)
+        return np.stack([((matrix @ planes) > 0).astype(np.int64) @ weights for planes in self.planes])
+    
+    def fit(self, matrix):
+        """Hash every row and keep the buckets as sorted code arrays"""
+        rng = np.random.default_rng(self.seed)
+        self.planes = rng.standard_normal((self.n_tables, matrix.shape[1], self.n_bits)).astype(np.float32)
+        codes = self._codes(matrix)
+        self.orders = np.argsort(codes, axis=1, kind='stable').astype(np.int32)
+        self.sorted_codes = np.take_along_axis(codes, self.orders, axis=1)
+        return self
+    
+    def candidates(self, vectors):
+        """Return candidate row positions for each query vector"""
+        codes = self._codes(vectors)
+        lo = [np.searchsorted(self.sorted_codes[t], codes[t], side='left') for t in range(self.n_tables)]
+        hi = [np.searchsorted(self.sorted_codes[t], codes[t], side='right') for t in range(self.n_tables)]
+        
+        results = []
+        for q in range(codes.shape[1]):
+            hits = np.concatenate([self.orders[t][lo[t][q]:hi[t][q]] for t in range(self.n_tables)])
+            cand, counts = np.unique(hits, return_counts=True)
+            if len(cand) > self.max_candidates:
+                # Keep the movies that collided with the query in the most tables
+                cand = cand[np.argpartition(-counts, self.max_candidates)[:self.max_candidates]]
+            results.append(cand)
+        return results
 
 class RecommenderSystem:
     def __init__(self):
         self.movies_df = None
+        self.vectorizer = None
         self.tfidf_matrix = None
         self.cosine_sim = None
         self.indices = None
+        # Top-k neighbour index (row i holds the k most similar movies to movie i)
+        self.neighbor_indices = None
+        self.neighbor_scores = None
+        self.title_index = None
+        self.ann_index = None
+        # Incremental update state
+        self.removed_rows = np.empty(0, dtype=np.int64)
+        self.fit_size = 0
+        self.rows_changed = 0
+        self.oov_rows = 0
+        self.needs_rebuild = False
+        # Upper bound for the dense similarity blocks when no block_size is given
+        self.memory_budget = 256 * 2**20
+        
+    def load_data(self, filepath, columns=('movieId', 'title', 'genres', 'rating'), chunksize=1_000_000):
+        """Load movie dataset
+
+        Only the needed columns are read. CSV files are streamed in chunks,
+        and .parquet/.feather/.arrow files are read through pyarrow.
+        """
+        ext = os.path.splitext(filepath)[1].lower()
+        
+        if ext in ('.parquet', '.pq', '.feather', '.arrow'):
+            import pyarrow.dataset as ds
+            dataset = ds.dataset(filepath, format='parquet' if ext in ('.parquet', '.pq') else 'feather')
+            wanted = [c for c in columns if c in dataset.schema.names]
+            self.movies_df = self._optimize_dtypes(dataset.to_table(columns=wanted).to_pandas())
+        else:
+            chunks = [self._optimize_dtypes(chunk) for chunk in
+                      pd.read_csv(filepath, usecols=lambda c: c in columns, chunksize=chunksize)]
+            self.movies_df = self._concat_movies(chunks)
         
-    def load_data(self, filepath):
-        """Load movie dataset"""
-        self.movies_df = pd.read_csv(filepath)
         print(f"Loaded dataset with {self.movies_df.shape[0]} movies")
+    
+    @staticmethod
+    def _optimize_dtypes(df):
+        """Downcast numeric columns and store genres as a categorical"""
+        if 'movieId' in df.columns:
+            df['movieId'] = pd.to_numeric(df['movieId'], downcast='integer')
+        if 'rating' in df.columns:
+            df['rating'] = pd.to_numeric(df['rating'], downcast='float')
+        if 'genres' in df.columns:
+            df['genres'] = df['genres'].astype('category')
+        return df
+    
+    @staticmethod
+    def _concat_movies(frames):
+        """Concatenate movie frames, keeping genres categorical across them"""
+        frames = [f for f in frames if len(f)] or frames[:1]
+        movies = pd.concat(frames, ignore_index=True)
+        if 'genres' in movies.columns and len(frames) > 1:
+            # A frame with only missing genres has categories of another dtype,
+            # which union_categoricals rejects, so bring them all to object first
+            genres = [f['genres'].astype('category') for f in frames]
+            genres = [g.cat.set_categories(g.cat.categories.astype(object)) for g in genres]
+            movies['genres'] = union_categoricals(genres)
+        return movies
         
-    def create_sample_data(self, size=1000):
-        """Create sample movie data if no dataset is available"""
-        genres = ['Action', 'Adventure', 'Animation', 'Comedy', 'Crime', 'Documentary', 
-                 'Drama', 'Family', 'Fantasy', 'History', 'Horror', 'Music', 'Mystery',
-                 'Romance', 'Science Fiction', 'Thriller', 'War', 'Western']
-        
-        # Generate sample movie data
-        movies = []
-        for i in range(size):
-            # Generate random movie details
-            movie_id = i + 1
-            title = f"Sample Movie {movie_id}"
-            year = np.random.randint(1970, 2023)
+    def create_sample_data(self, size=1000, seed=None, output=None, chunk_size=100_000):
+        """Create sample movie data if no dataset is available
+
+        Pass output (a .csv or .parquet path) to stream the rows to disk in
+        chunks instead of keeping them in memory.
+        """
+        chunks = self._sample_chunks(size, seed, chunk_size)
+        
+        if output is None:
+            self.movies_df = pd.concat(chunks, ignore_index=True)
+            print(f"Created sample dataset with {size} movies")
+        elif output.endswith('.parquet'):
+            try:
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+            except ImportError:
+                print("Writing Parquet requires pyarrow. Please install it first.")
+                return
             
-            # Assign 1-3 random genres
-            num_genres = np.random.randint(1, 4)
-            movie_genres = '|'.join(np.random.choice(genres, num_genres, replace=False))
+            writer = None
+            for chunk in chunks:
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(output, table.schema)
+                writer.write_table(table)
+            if writer is not None:
+                writer.close()
+            print(f"Wrote sample dataset with {size} movies to {output}")
+        else:
+            for i, chunk in enumerate(chunks):
+                chunk.to_csv(output, index=False, mode='w' if i == 0 else 'a', header=i == 0)
+            print(f"Wrote sample dataset with {size} movies to {output}")
+    
+    def _sample_chunks(self, size, seed=None, chunk_size=100_000):
+        """Generate sample movies in chunks, sampling every column in bulk"""
+        genres = np.array(['Action', 'Adventure', 'Animation', 'Comedy', 'Crime', 'Documentary', 
+                           'Drama', 'Family', 'Fantasy', 'History', 'Horror', 'Music', 'Mystery',
+                           'Romance', 'Science Fiction', 'Thriller', 'War', 'Western'], dtype=object)
+        rng = np.random.default_rng(seed)
+        
+        # size=0 still yields one empty chunk, so callers always get the columns
+        for start in range(0, max(size, 1), chunk_size):
+            count = min(chunk_size, size - start)
+            movie_ids = np.arange(start + 1, start + count + 1)
+            years = rng.integers(1970, 2023, count)
+            
+            # Assign 1-3 distinct random genres: the first columns of a random permutation
+            num_genres = rng.integers(1, 4, count)
+            picks = genres[np.argsort(rng.random((count, len(genres))), axis=1)[:, :3]]
+            movie_genres = picks[:, 0].copy()
+            for j in (1, 2):
+                mask = num_genres > j
+                movie_genres[mask] = movie_genres[mask] + '|' + picks[mask, j]
             
-            # Generate random rating
-            rating = round(np.random.uniform(1.0, 10.0), 1)
+            # Generate random ratings
+            ratings = np.round(rng.uniform(1.0, 10.0, count), 1)
             
-            movies.append({
-                'movieId': movie_id,
-                'title': f"{title} ({year})",
+            titles = 'Sample Movie ' + pd.Series(movie_ids).astype(str) + ' (' + pd.Series(years).astype(str) + ')'
+            yield pd.DataFrame({
+                'movieId': movie_ids,
+                'title': titles.to_numpy(),
                 'genres': movie_genres,
-                'rating': rating
+                'rating': ratings
             })
         
-        self.movies_df = pd.DataFrame(movies)
-        print(f"Created sample dataset with {size} movies")
-        
-    def preprocess_data(self):
-        """Preprocess data and create feature vectors"""
+    def preprocess_data(self, top_k=None, block_size=None):
+        """Preprocess data and create feature vectors
+
+        With top_k set, only the k nearest neighbours of every movie are kept
+        instead of the dense N x N similarity matrix.
+        """
         if self.movies_df is None:
             print("No data loaded. Please load data first.")
             return False
             
         # Create a new soup feature
         if 'genres' in self.movies_df.columns:
+            # TF-IDF cannot be fitted without at least one genre
+            genres = self.movies_df['genres'].dropna().astype(str).str.strip()
+            if not (genres != '').any():
+                print("No genres found in dataset. Please load movies with genres first.")
+                return False
+            
             # Use TF-IDF vectorizer for genre features
-            tfidf = TfidfVectorizer(stop_words='english')
-            self.tfidf_matrix = tfidf.fit_transform(self.movies_df['genres'].fillna(''))
+            self.vectorizer = TfidfVectorizer(stop_words='english')
+            self.tfidf_matrix = self._genre_matrix(self.movies_df['genres'], fit=True)
             
-            # Compute cosine similarity matrix
-            self.cosine_sim = cosine_similarity(self.tfidf_matrix, self.tfidf_matrix)
+            if top_k is None:
+                # Compute cosine similarity matrix
+                self.cosine_sim = cosine_similarity(self.tfidf_matrix, self.tfidf_matrix)
+                self.neighbor_indices = None
+                self.neighbor_scores = None
+            else:
+                # Keep only the top-k neighbours so memory grows linearly
+                self.cosine_sim = None
+                self.build_neighbor_index(top_k, block_size)
             
             # Create a reverse mapping
             self.indices = pd.Series(self.movies_df.index, index=self.movies_df['title']).drop_duplicates()
+            self.title_index = TitleIndex(self.movies_df['title'])
+            self.ann_index = None
+            
+            self.removed_rows = np.empty(0, dtype=np.int64)
+            self.fit_size = len(self.movies_df)
+            self.rows_changed = 0
+            self.oov_rows = 0
+            self.needs_rebuild = False
             
             return True
         else:
             print("Required columns not found in dataset")
             return False
     
-    def get_recommendations(self, title, n=10):
-        """Generate movie recommendations based on a movie title"""
-        if self.cosine_sim is None:
-            print("Model not initialized. Please preprocess data first.")
-            return None
+    def _genre_matrix(self, genres, fit=False):
+        """Vectorize a genres column, tokenizing each distinct genre string only once"""
+        if not isinstance(genres.dtype, pd.CategoricalDtype):
+            genres = genres.fillna('')
+            return self.vectorizer.fit_transform(genres) if fit else self.vectorizer.transform(genres)
         
-        # Get the index of the movie that matches the title
+        categories = genres.cat.categories.astype(str)
+        codes = genres.cat.codes.to_numpy().copy()
+        
+        if fit:
+            self.vectorizer.fit(categories)
+            # Weight document frequencies by how often each category occurs so the
+            # idf matches fitting on every row (missing genres are empty documents)
+            counts = np.bincount(codes[codes >= 0], minlength=len(categories))
+            present = self.vectorizer.transform(categories) > 0
+            doc_freq = np.asarray(present.T @ counts).ravel()
+            self.vectorizer.idf_ = np.log((1 + len(codes)) / (1 + doc_freq)) + 1
+        
+        # One TF-IDF row per category plus an empty row for missing genres
+        category_matrix = sparse.vstack([self.vectorizer.transform(categories),
+                                         sparse.csr_matrix((1, len(self.vectorizer.vocabulary_)))], format='csr')
+        codes[codes < 0] = len(categories)
+        return category_matrix[codes]
+    
+    def build_neighbor_index(self, top_k=50, block_size=None):
+        """Build the top-k neighbour index in row blocks of the TF-IDF matrix"""
+        num_movies = self.tfidf_matrix.shape[0]
+        k = max(0, min(top_k, num_movies - 1))
+        
+        self.neighbor_indices = np.empty((num_movies, k), dtype=np.int32)
+        self.neighbor_scores = np.empty((num_movies, k), dtype=np.float32)
+        if k == 0:
+            return
+        
+        self._fill_neighbors(np.arange(num_movies), block_size)
+    
+    def _block_rows(self, block_size=None):
+        """Rows per dense similarity block: block_size, or as many as fit in memory_budget"""
+        if block_size:
+            return block_size
+        # Per similarity column at most ~24 bytes are live at once: the sparse
+        # product (float64 value + int32 index) next to its float32 copy, then
+        # the dense float32 row next to argpartition's int64 index
+        row_bytes = 24 * max(self.tfidf_matrix.shape[0], 1)
+        return int(max(1, self.memory_budget // row_bytes))
+    
+    def _fill_neighbors(self, rows, block_size=None):
+        """Recompute the neighbour lists of the given rows"""
+        block_size = self._block_rows(block_size)
+        k = self.neighbor_indices.shape[1]
+        # Only a block_size x N dense block is materialised at any time
+        for start in range(0, len(rows), block_size):
+            block = rows[start:start + block_size]
+            top, top_scores = self._top_n(self._similarity_rows(block), k, block)
+            self.neighbor_indices[block] = top
+            self.neighbor_scores[block] = top_scores
+    
+    def _similarity_rows(self, rows):
+        """Return the dense similarity rows for the given movie positions"""
+        if self.cosine_sim is not None:
+            sims = np.asarray(self.cosine_sim[rows], dtype=np.float32)
+        else:
+            # TF-IDF rows are L2-normalised, so the dot product is the cosine similarity;
+            # casting while still sparse means the dense block is only ever float32
+            sims = (self.tfidf_matrix[rows] @ self.tfidf_matrix.T).astype(np.float32).toarray()
+        
+        # Removed movies can never be recommended
+        sims[:, self.removed_rows] = -np.inf
+        return sims
+    
+    @staticmethod
+    def _top_n(sims, n, exclude=None):
+        """Select the n best columns of each row, optionally skipping each row's own movie
+
+        A float32 sims array is used as is (not copied) and modified in place
+        when exclude is given.
+        """
+        sims = np.atleast_2d(np.asarray(sims, dtype=np.float32))
+        if exclude is not None:
+            exclude = np.atleast_1d(exclude)
+            sims[np.arange(len(exclude)), exclude] = -np.inf
+        
+        n = max(0, min(n, sims.shape[1] - (exclude is not None)))
+        if n == 0:
+            return np.empty((len(sims), 0), dtype=np.int32), np.empty((len(sims), 0), dtype=np.float32)
+        
+        # argpartition finds the n best in O(N); only those n get sorted
+        top = np.argpartition(sims, -n, axis=1)[:, -n:]
+        top_scores = np.take_along_axis(sims, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind='stable')
+        return np.take_along_axis(top, order, axis=1).astype(np.int32), np.take_along_axis(top_scores, order, axis=1)
+    
+    def _resolve_title(self, title):
+        """Return the row position of a title, falling back to the closest match"""
         if title not in self.indices:
             closest_match = self.find_closest_match(title)
             if closest_match:
@@ -86,40 +491,332 @@ class RecommenderSystem:
                 print(f"Movie '{title}' not found and no close matches.")
                 return None
         
-        idx = self.indices[title]
+        return self.indices[title]
+    
+    def _recommend_rows(self, rows, n, method='auto', block_size=None):
+        """Return (indices, scores) arrays of the top n movies for each query row
+
+        method is 'index' (precomputed neighbours), 'ann' (approximate
+        backend), 'exact' (full similarity rows) or 'auto' for the first
+        available in that order. Missing slots are padded with index -1.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if method == 'auto':
+            method = 'index' if self.neighbor_indices is not None else 'ann' if self.ann_index is not None else 'exact'
         
-        # Get the pairwise similarity scores
-        sim_scores = list(enumerate(self.cosine_sim[idx]))
+        if method == 'index':
+            # Read the precomputed neighbours straight from the index
+            if n > self.neighbor_indices.shape[1]:
+                print(f"Only {self.neighbor_indices.shape[1]} neighbours are indexed per movie.")
+            return self.neighbor_indices[rows, :n], self.neighbor_scores[rows, :n]
         
-        # Sort movies by similarity scores
-        sim_scores = sorted(sim_scores, key=lambda x: x[1], reverse=True)
+        if method == 'ann':
+            # Re-rank the backend's candidates exactly; removed movies and the query are dropped
+            movie_indices = np.full((len(rows), n), -1, dtype=np.int32)
+            scores = np.full((len(rows), n), -np.inf, dtype=np.float32)
+            vectors = self.tfidf_matrix[rows]
+            for i, cand in enumerate(self.ann_index.candidates(vectors)):
+                cand = cand[(cand != rows[i]) & ~np.isin(cand, self.removed_rows)]
+                sims = (self.tfidf_matrix[cand] @ vectors[i].T).toarray().ravel()
+                top, top_scores = self._top_n(sims, n)
+                movie_indices[i, :top.shape[1]] = cand[top[0]]
+                scores[i, :top.shape[1]] = top_scores[0]
+            return movie_indices, scores
         
-        # Get top N most similar movies
-        sim_scores = sim_scores[1:n+1]
+        # Select the top N from the similarity rows without sorting all of them,
+        # with one matrix product and one selection per block of query rows
+        block_size = self._block_rows(block_size)
+        blocks = [self._top_n(self._similarity_rows(rows[i:i + block_size]), n, rows[i:i + block_size])
+                  for i in range(0, len(rows), block_size)]
+        if not blocks:
+            return np.empty((0, 0), dtype=np.int32), np.empty((0, 0), dtype=np.float32)
+        return np.vstack([b[0] for b in blocks]), np.vstack([b[1] for b in blocks])
+    
+    def get_recommendations(self, title, n=10, method='auto'):
+        """Generate movie recommendations based on a movie title"""
+        if self.tfidf_matrix is None:
+            print("Model not initialized. Please preprocess data first.")
+            return None
         
-        # Get movie indices
-        movie_indices = [i[0] for i in sim_scores]
+        # Get the index of the movie that matches the title
+        idx = self._resolve_title(title)
+        if idx is None:
+            return None
+        
+        movie_indices, scores = self._recommend_rows([idx], n, method)
+        valid = movie_indices[0] >= 0
         
         # Return top movies with similarity scores
-        recommendations = self.movies_df.iloc[movie_indices][['title', 'genres']]
-        recommendations['similarity'] = [i[1] for i in sim_scores]
+        recommendations = self.movies_df.iloc[movie_indices[0][valid]][['title', 'genres']]
+        recommendations['similarity'] = scores[0][valid]
         
         return recommendations
     
+    def get_batch_recommendations(self, titles=None, n=10, method='auto', block_size=None):
+        """Generate recommendations for many titles (or the whole catalog) at once"""
+        if self.tfidf_matrix is None:
+            print("Model not initialized. Please preprocess data first.")
+            return None
+        
+        if titles is None:
+            rows = np.setdiff1d(np.arange(len(self.movies_df)), self.removed_rows)
+        else:
+            rows = [self._resolve_title(title) for title in titles]
+            rows = np.array([idx for idx in rows if idx is not None], dtype=np.int64)
+        
+        movie_indices, scores = self._recommend_rows(rows, n, method, block_size)
+        
+        # Flatten into one long table: one row per (query, recommendation)
+        width = movie_indices.shape[1]
+        flat = movie_indices.ravel()
+        valid = flat >= 0
+        titles_arr = self.movies_df['title'].to_numpy()
+        return pd.DataFrame({
+            'query': np.repeat(titles_arr[rows], width)[valid],
+            'rank': np.tile(np.arange(1, width + 1), len(rows))[valid],
+            'title': titles_arr[flat[valid]],
+            'genres': self.movies_df['genres'].to_numpy()[flat[valid]],
+            'similarity': scores.ravel()[valid]
+        })
+    
+    def build_ann_index(self, backend=None, **params):
+        """Build an approximate-nearest-neighbour backend over the TF-IDF vectors
+
+        Any object with fit(matrix) and candidates(vectors) can be plugged in;
+        by default a RandomProjectionLSH is built with the given params.
+        """
+        if self.tfidf_matrix is None:
+            print("Model not initialized. Please preprocess data first.")
+            return False
+        
+        self.ann_index = backend if backend is not None else RandomProjectionLSH(**params)
+        self.ann_index.fit(self.tfidf_matrix)
+        return True
+    
+    def evaluate_ann_recall(self, k=10, sample_size=500, seed=0):
+        """Measure recall@k and query time of the ANN backend against exact search
+
+        A returned movie counts as a hit when its similarity reaches the exact
+        k-th score, so ties between equally similar movies are not penalised.
+        """
+        if self.ann_index is None:
+            print("No ANN index. Please build it first.")
+            return None
+        
+        live = np.setdiff1d(np.arange(len(self.movies_df)), self.removed_rows)
+        rng = np.random.default_rng(seed)
+        rows = rng.choice(live, min(sample_size, len(live)), replace=False)
+        
+        start = time.perf_counter()
+        _, exact_scores = self._recommend_rows(rows, k, 'exact')
+        exact_time = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        ann_indices, ann_scores = self._recommend_rows(rows, k, 'ann')
+        ann_time = time.perf_counter() - start
+        
+        # Small tolerance for float32 rounding between the two paths
+        kth = exact_scores[:, -1:] - 1e-6
+        hits = ((ann_scores >= kth) & (ann_indices >= 0)).sum(axis=1)
+        results = {
+            'recall': float(np.mean(hits / exact_scores.shape[1])),
+            'exact_ms_per_query': 1000 * exact_time / len(rows),
+            'ann_ms_per_query': 1000 * ann_time / len(rows)
+        }
+        print(f"ANN recall@{k}: {results['recall']:.3f} "
+              f"({results['ann_ms_per_query']:.2f} ms vs {results['exact_ms_per_query']:.2f} ms exact per query)")
+        return results
+    
     def find_closest_match(self, title):
         """Find closest matching movie title"""
-        titles = self.movies_df['title'].values
-        closest = None
-        max_sim = -1
-        
-        for t in titles:
-            # Simple string similarity - count matching characters
-            sim = sum(c1 == c2 for c1, c2 in zip(title.lower(), t.lower())) / max(len(title), len(t))
-            if sim > max_sim and sim > 0.5:  # Threshold for similarity
-                max_sim = sim
-                closest = t
+        if self.title_index is None:
+            self.title_index = TitleIndex(self.movies_df['title'])
+        
+        # Skip titles that were removed since the index was built
+        for position, _ in self.title_index.search(title, limit=10):
+            if position not in self.removed_rows:
+                return self.movies_df['title'].iloc[position]
+        
+        return None
+    
+    def add_movies(self, df, block_size=None):
+        """Add movies using the fitted vocabulary, updating only affected neighbour lists"""
+        if self.tfidf_matrix is None:
+            print("Model not initialized. Please preprocess data first.")
+            return False
+        
+        genres = df['genres'].astype(object).fillna('')
+        new_matrix = self._genre_matrix(df['genres'])
+        
+        # Genres outside the fitted vocabulary are silently dropped by transform
+        analyzer = self.vectorizer.build_analyzer()
+        vocabulary = self.vectorizer.vocabulary_
+        self.oov_rows += sum(any(t not in vocabulary for t in analyzer(g)) for g in genres)
+        
+        start = len(self.movies_df)
+        new_rows = np.arange(start, start + len(df))
+        self.movies_df = self._concat_movies([self.movies_df, df])
+        self.tfidf_matrix = sparse.vstack([self.tfidf_matrix, new_matrix], format='csr')
+        
+        if self.neighbor_indices is not None:
+            k = self.neighbor_indices.shape[1]
+            self.neighbor_indices = np.vstack([self.neighbor_indices, np.empty((len(df), k), dtype=np.int32)])
+            self.neighbor_scores = np.vstack([self.neighbor_scores, np.empty((len(df), k), dtype=np.float32)])
+            
+            # Existing movies only change where a new movie beats their k-th neighbour
+            if k:
+                block_size = self._block_rows(block_size)
+                for block_start in range(0, start, block_size):
+                    rows = np.arange(block_start, min(block_start + block_size, start))
+                    cand = (self.tfidf_matrix[rows] @ new_matrix.T).astype(np.float32).toarray()
+                    better = cand.max(axis=1, initial=-np.inf) > self.neighbor_scores[rows, -1]
+                    if not better.any():
+                        continue
+                    
+                    rows, cand = rows[better], cand[better]
+                    all_indices = np.hstack([self.neighbor_indices[rows], np.broadcast_to(new_rows, cand.shape)])
+                    all_scores = np.hstack([self.neighbor_scores[rows], cand])
+                    top, top_scores = self._top_n(all_scores, k)
+                    self.neighbor_indices[rows] = np.take_along_axis(all_indices, top, axis=1)
+                    self.neighbor_scores[rows] = top_scores
                 
-        return closest
+                self._fill_neighbors(new_rows, block_size)
+        else:
+            # The dense matrix has no cheaper update; the TF-IDF fit is still reused
+            self.cosine_sim = cosine_similarity(self.tfidf_matrix, self.tfidf_matrix)
+        
+        new_titles = pd.Series(new_rows, index=df['title'].to_numpy())
+        new_titles = new_titles[~new_titles.index.isin(self.indices.index) & ~new_titles.index.duplicated()]
+        self.indices = pd.concat([self.indices, new_titles])
+        self.title_index.add(df['title'])
+        if self.ann_index is not None:
+            self.ann_index.fit(self.tfidf_matrix)
+        
+        self._record_changes(len(df))
+        print(f"Added {len(df)} movies")
+        return True
+    
+    def remove_movies(self, ids, block_size=None):
+        """Remove movies by movieId, repairing only the neighbour lists that referenced them"""
+        if self.tfidf_matrix is None:
+            print("Model not initialized. Please preprocess data first.")
+            return False
+        
+        if 'movieId' in self.movies_df.columns:
+            rows = np.flatnonzero(self.movies_df['movieId'].isin(ids).to_numpy())
+        else:
+            rows = np.asarray(ids, dtype=np.int64)
+        rows = np.setdiff1d(rows, self.removed_rows)
+        if len(rows) == 0:
+            print("No matching movies to remove.")
+            return False
+        
+        # Rows stay in place as tombstones so no other position shifts
+        self.removed_rows = np.union1d(self.removed_rows, rows)
+        self.indices = self.indices[~self.indices.isin(rows)]
+        
+        if self.neighbor_indices is not None:
+            if not self.neighbor_indices.flags.writeable:
+                self.neighbor_indices = np.array(self.neighbor_indices)
+                self.neighbor_scores = np.array(self.neighbor_scores)
+            affected = np.flatnonzero(np.isin(self.neighbor_indices, rows).any(axis=1))
+            affected = np.setdiff1d(affected, self.removed_rows)
+            self._fill_neighbors(affected, block_size)
+        
+        self._record_changes(len(rows))
+        print(f"Removed {len(rows)} movies")
+        return True
+    
+    def _record_changes(self, count, max_drift=0.2, max_oov=0.05):
+        """Track drift from the fitted model and flag when a full rebuild is due"""
+        self.rows_changed += count
+        drift = self.rows_changed / max(self.fit_size, 1)
+        oov = self.oov_rows / max(self.rows_changed, 1)
+        if not self.needs_rebuild and (drift > max_drift or oov > max_oov):
+            self.needs_rebuild = True
+            print(f"Catalog drift is {drift:.0%} ({self.oov_rows} movies with unknown genres); "
+                  "run preprocess_data again for a full rebuild.")
+    
+    def save_model(self, path):
+        """Save the fitted model as .npy/binary artifacts in a directory"""
+        if self.tfidf_matrix is None:
+            print("Model not initialized. Please preprocess data first.")
+            return False
+        
+        os.makedirs(path, exist_ok=True)
+        matrix = self.tfidf_matrix.tocsr()
+        meta = {
+            'vocabulary': {term: int(i) for term, i in self.vectorizer.vocabulary_.items()},
+            'stop_words': self.vectorizer.stop_words,
+            'shape': list(matrix.shape),
+            'fit_size': self.fit_size,
+            'rows_changed': self.rows_changed,
+            'oov_rows': self.oov_rows,
+            'needs_rebuild': self.needs_rebuild
+        }
+        with open(os.path.join(path, 'model.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        
+        np.save(os.path.join(path, 'idf.npy'), self.vectorizer.idf_)
+        np.save(os.path.join(path, 'tfidf_data.npy'), matrix.data)
+        np.save(os.path.join(path, 'tfidf_indices.npy'), matrix.indices)
+        np.save(os.path.join(path, 'tfidf_indptr.npy'), matrix.indptr)
+        np.save(os.path.join(path, 'removed_rows.npy'), self.removed_rows)
+        
+        if self.neighbor_indices is not None:
+            np.save(os.path.join(path, 'neighbor_indices.npy'), self.neighbor_indices)
+            np.save(os.path.join(path, 'neighbor_scores.npy'), self.neighbor_scores)
+        elif self.cosine_sim is not None:
+            np.save(os.path.join(path, 'cosine_sim.npy'), self.cosine_sim)
+        
+        if self.title_index is None:
+            self.title_index = TitleIndex(self.movies_df['title'])
+        self.title_index.save(path)
+        self.movies_df.to_pickle(os.path.join(path, 'movies.pkl'))
+        
+        print(f"Model saved to {path}")
+        return True
+    
+    def load_model(self, path, mmap_mode='r'):
+        """Load a saved model, memory-mapping the large arrays
+
+        Pages of mapped files are shared between processes that load the
+        same model, so worker start-up does not copy them.
+        """
+        def load_array(name):
+            file = os.path.join(path, name)
+            return np.load(file, mmap_mode=mmap_mode) if os.path.exists(file) else None
+        
+        with open(os.path.join(path, 'model.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        
+        self.vectorizer = TfidfVectorizer(stop_words=meta['stop_words'], vocabulary=meta['vocabulary'])
+        self.vectorizer.vocabulary_ = meta['vocabulary']
+        self.vectorizer.idf_ = np.load(os.path.join(path, 'idf.npy'))
+        
+        self.tfidf_matrix = sparse.csr_matrix(
+            (load_array('tfidf_data.npy'), load_array('tfidf_indices.npy'), load_array('tfidf_indptr.npy')),
+            shape=tuple(meta['shape']), copy=False)
+        self.neighbor_indices = load_array('neighbor_indices.npy')
+        self.neighbor_scores = load_array('neighbor_scores.npy')
+        self.cosine_sim = load_array('cosine_sim.npy')
+        self.title_index = TitleIndex.load(path, mmap_mode)
+        self.ann_index = None
+        
+        removed_rows = load_array('removed_rows.npy')
+        self.removed_rows = np.empty(0, dtype=np.int64) if removed_rows is None else np.array(removed_rows)
+        self.fit_size = meta.get('fit_size', meta['shape'][0])
+        self.rows_changed = meta.get('rows_changed', 0)
+        self.oov_rows = meta.get('oov_rows', 0)
+        self.needs_rebuild = meta.get('needs_rebuild', False)
+        
+        self.movies_df = pd.read_pickle(os.path.join(path, 'movies.pkl'))
+        self.indices = pd.Series(self.movies_df.index, index=self.movies_df['title']).drop_duplicates()
+        # Removed movies stay in movies_df as tombstones but must not resolve by title
+        self.indices = self.indices[~self.indices.isin(self.removed_rows)]
+        
+        print(f"Loaded model from {path} with {self.movies_df.shape[0]} movies")
+        return True
     
     def visualize_recommendations(self, recommendations):
         """Visualize recommendation results"""
@@ -133,6 +830,100 @@ class RecommenderSystem:
             plt.tight_layout()
             plt.show()
 
+# Model loaded once per worker process; its arrays are memory-mapped and shared
+_worker_recommender = None
+
+def _init_worker(model_path):
+    global _worker_recommender
+    _worker_recommender = RecommenderSystem()
+    with redirect_stdout(io.StringIO()):
+        _worker_recommender.load_model(model_path)
+
+def _score_rows(rows, n):
+    movie_indices, scores = _worker_recommender._recommend_rows(rows, n)
+    return rows, movie_indices, scores
+
+def score_catalog(model_path, titles='all', output='recommendations.jsonl', n=10, workers=None, chunk_size=1000):
+    """Score many titles across a process pool and stream the results to CSV or JSONL"""
+    timings = {}
+    start = time.perf_counter()
+    recommender = RecommenderSystem()
+    recommender.load_model(model_path)
+    timings['load'] = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    if titles == 'all':
+        rows = np.setdiff1d(np.arange(len(recommender.movies_df)), recommender.removed_rows)
+    else:
+        with open(titles, encoding='utf-8') as f:
+            rows = [recommender._resolve_title(line.strip()) for line in f if line.strip()]
+        rows = np.array([idx for idx in rows if idx is not None], dtype=np.int64)
+    chunks = [rows[i:i + chunk_size] for i in range(0, len(rows), chunk_size)]
+    timings['resolve'] = time.perf_counter() - start
+    
+    workers = workers or os.cpu_count()
+    if workers > 1:
+        pool = ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(model_path,))
+        results = pool.map(_score_rows, chunks, [n] * len(chunks))
+    else:
+        pool = None
+        global _worker_recommender
+        _worker_recommender = recommender
+        results = map(_score_rows, chunks, [n] * len(chunks))
+    
+    titles_arr = recommender.movies_df['title'].to_numpy()
+    score_time = write_time = 0.0
+    start = time.perf_counter()
+    with open(output, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f) if output.endswith('.csv') else None
+        if writer:
+            writer.writerow(['query', 'rank', 'title', 'similarity'])
+        
+        # Chunks arrive in order as workers finish, so the output is written as a stream
+        for chunk_rows, movie_indices, scores in results:
+            ready = time.perf_counter()
+            score_time += ready - start
+            for row, indices, row_scores in zip(chunk_rows, movie_indices, scores):
+                valid = indices >= 0
+                recs = zip(titles_arr[indices[valid]], row_scores[valid].tolist())
+                if writer:
+                    writer.writerows((titles_arr[row], rank, title, round(score, 6))
+                                     for rank, (title, score) in enumerate(recs, 1))
+                else:
+                    f.write(json.dumps({'query': titles_arr[row],
+                                        'recommendations': [{'title': title, 'similarity': round(score, 6)}
+                                                            for title, score in recs]}) + '\n')
+            start = time.perf_counter()
+            write_time += start - ready
+    
+    if pool is not None:
+        pool.shutdown()
+    
+    timings['score'] = score_time
+    timings['write'] = write_time
+    total = sum(timings.values())
+    print(f"Scored {len(rows)} titles with {workers} worker(s) in {total:.2f}s "
+          f"({len(rows) / max(total, 1e-9):,.0f} queries/s)")
+    for stage, seconds in timings.items():
+        print(f"  {stage:<8} {seconds:.3f}s")
+    return timings
+
+def run_cli(argv):
+    parser = argparse.ArgumentParser(description="Movie Recommender System batch tools")
+    commands = parser.add_subparsers(dest='command', required=True)
+    
+    score = commands.add_parser('score', help="Bulk-score titles from a saved model")
+    score.add_argument('model', help="Directory written by save_model")
+    score.add_argument('--titles', default='all', help="File with one title per line, or 'all'")
+    score.add_argument('--output', default='recommendations.jsonl', help="Output .jsonl or .csv file")
+    score.add_argument('-n', type=int, default=10, help="Recommendations per title")
+    score.add_argument('--workers', type=int, default=None, help="Worker processes (default: CPU count)")
+    score.add_argument('--chunk-size', type=int, default=1000, help="Titles per work unit")
+    
+    args = parser.parse_args(argv)
+    if args.command == 'score':
+        score_catalog(args.model, args.titles, args.output, args.n, args.workers, args.chunk_size)
+
 def main():
     recommender = RecommenderSystem()
     
@@ -142,9 +933,11 @@ def main():
         print("2. Load movie data")
         print("3. Preprocess data")
         print("4. Get recommendations")
-        print("5. Exit")
+        print("5. Save model")
+        print("6. Load model")
+        print("7. Exit")
         
-        choice = input("\nEnter your choice (1-5): ")
+        choice = input("\nEnter your choice (1-7): ")
         
         if choice == '1':
             size = int(input("Enter number of sample movies to create: "))
@@ -158,7 +951,9 @@ def main():
                 print(f"Error loading data: {e}")
                 
         elif choice == '3':
-            if recommender.preprocess_data():
+            top_k = input("Neighbours to keep per movie (press Enter for full matrix): ")
+            top_k = int(top_k) if top_k.strip() else None
+            if recommender.preprocess_data(top_k=top_k):
                 print("Data preprocessing complete!")
                 
         elif choice == '4':
@@ -174,6 +969,17 @@ def main():
                 print("Please preprocess data first (option 3).")
                 
         elif choice == '5':
+            path = input("Enter directory to save the model to: ")
+            recommender.save_model(path)
+            
+        elif choice == '6':
+            path = input("Enter saved model directory: ")
+            try:
+                recommender.load_model(path)
+            except Exception as e:
+                print(f"Error loading model: {e}")
+                
+        elif choice == '7':
             print("Thank you for using the Movie Recommender!")
             break
             
@@ -181,4 +987,7 @@ def main():
             print("Invalid choice! Please try again.")
 
 if __name__ == "__main__":
-    main()
+    if len(sys.argv) > 1:
+        run_cli(sys.argv[1:])
+    else:
+        main()